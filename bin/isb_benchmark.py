@@ -0,0 +1,59 @@
+#!/usr/bin/python3
+
+import argparse
+from isabella.environment_desc import lasted_seconds
+from isabella.benchmark import create_benchmark, benchmark_results, scaling_table, store_results, parse_alignments, \
+    STANDARD_ALIGNMENTS, THREAD_COUNTS
+
+
+def create(directory=None, programs=None, threads=None, alignments=None, **kwargs):
+    num_jobs = create_benchmark(directory, program_types=programs.split(','),
+                                thread_counts=[int(t) for t in threads.split(',')],
+                                alignments=parse_alignments(alignments), **kwargs)
+    print(f'Benchmark created with {num_jobs} jobs.')
+
+
+def _num(v, fmt, width):
+    return f'{v:{width}{fmt}}' if v is not None else f"{'-':>{width}}"
+
+
+def report(directory=None, store=False, database=None, **kwargs):
+    print(f"{'program':>10} {'input':>11} {'slots':>5} {'runs':>4} {'wall':>9} {'cpu':>9} {'memory':>9} "
+          f"{'speedup':>7} {'eff.':>5} {'cpu eff.':>8}")
+    for p, taxa, length, nslots, runs, seconds, cpu, rss, speedup, efficiency, cpu_efficiency in \
+            scaling_table(benchmark_results(directory)):
+        print(f"{p:>10} {f'{taxa}x{length}':>11} {nslots:5} {runs:4} {lasted_seconds(int(seconds)):>9} "
+              f"{lasted_seconds(int(cpu)) if cpu is not None else '-':>9} "
+              f"{f'{rss / 1024:.0f}MB' if rss is not None else '-':>9} {_num(speedup, '.2f', 7)} "
+              f"{_num(efficiency, '.2f', 5)} {_num(cpu_efficiency, '.2f', 8)}")
+    if store:
+        print(f'Stored {store_results(directory, database=database)} jobs into runtime database.')
+
+
+parser = argparse.ArgumentParser(description="Scaling benchmark of installed programs.")
+subparsers = parser.add_subparsers(dest='command')
+subparsers.required = True
+
+p = subparsers.add_parser('create', help="Create and submit benchmark jobs")
+p.add_argument('directory', help="Benchmark (processing) directory, shouldn't exist")
+p.add_argument('-p', '--programs', default='raxml,mr_bayes', help="Comma separated program types")
+p.add_argument('-t', '--threads', default=','.join(map(str, THREAD_COUNTS)), help="Comma separated thread counts")
+p.add_argument('-a', '--alignments', default=','.join(f'{t}x{l}' for t, l in STANDARD_ALIGNMENTS),
+               help="Comma separated test alignments sizes, <taxa>x<length>")
+p.add_argument('-r', '--repeats', default=1, type=int, help="Number of runs of each grid point")
+p.add_argument('-b', '--bootstraps', default=100, type=int, help="Number of RAxML bootstraps")
+p.add_argument('-g', '--ngen', default=100000, type=int, help="Number of MrBayes generations")
+p.add_argument('-A', '--array-job', action='store_true', help="Submit jobs as array jobs")
+p.add_argument('-P', '--project', help="SGE project")
+p.add_argument('-m', '--email', help="Email address for start/end notices")
+p.add_argument('-S', '--simulate', action='store_true', help="Simulate run, without actual running")
+p.set_defaults(method=create)
+
+p = subparsers.add_parser('report', help="Print scaling and efficiency table of finished benchmark jobs")
+p.add_argument('directory', help="Benchmark directory")
+p.add_argument('-s', '--store', action='store_true', help="Store results into runtime database")
+p.add_argument('-d', '--database', help="Runtime database file")
+p.set_defaults(method=report)
+
+params = parser.parse_args()
+params.method(**dict((k, v) for k, v in vars(params).items() if k not in ('command', 'method')))
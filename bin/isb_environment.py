@@ -0,0 +1,21 @@
+#!/usr/bin/python3
+
+import argparse
+from isabella.environment_desc import environment, get_programs, program_types, program_parallels
+from isabella.probe import PROBE_CACHE
+
+parser = argparse.ArgumentParser(description="Print installed programs and selected variants.")
+parser.add_argument('-r', '--refresh', action='store_true', help=f"Remove cached probe ({PROBE_CACHE}) first")
+params = parser.parse_args()
+
+if params.refresh:
+    import os
+    if os.path.isfile(PROBE_CACHE):
+        os.remove(PROBE_CACHE)
+
+env = environment()
+print(f"Installed: {', '.join(env['installed']) or '-'}")
+for program_type in program_types():
+    for parallel in program_parallels(program_type):
+        variants = get_programs(program_type, parallel)
+        print(f"{program_type} {parallel}: {', '.join(p.program for p in variants)}")
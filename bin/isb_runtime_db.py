@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+
+import argparse
+from isabella.environment_desc import lasted_seconds
+from isabella.runtime_db import RuntimeDB, RUNTIME_DB, JOB_COLUMNS
+
+
+def _columns(text):
+    columns = text.split(',')
+    unknown = [c for c in columns if c not in JOB_COLUMNS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown columns: {', '.join(unknown)}")
+    return columns
+
+
+def index(db, roots=None, **kwargs):
+    print(f'Indexed {db.index(roots)} jobs.')
+
+
+def query(db, program=None, group_by=None, **kwargs):
+    print(f"{' '.join(f'{g:>14}' for g in group_by)} {'count':>6} {'min':>9} {'median':>9} {'p90':>9} {'max':>9}")
+    for key, count, *values in db.distribution(group_by=group_by, program_type=program):
+        print(' '.join(f'{str(k):>14}' for k in key), f'{count:6}',
+              ' '.join(f'{lasted_seconds(int(v)):>9}' for v in values))
+
+
+parser = argparse.ArgumentParser(description="Database of job runtimes harvested from processings.")
+parser.add_argument('-d', '--database', default=RUNTIME_DB, help=f"Database file (default {RUNTIME_DB})")
+subparsers = parser.add_subparsers(dest='command')
+subparsers.required = True
+
+p = subparsers.add_parser('index', help="Index (incrementally) processings and jobs in directory trees")
+p.add_argument('roots', nargs='+', help="Directories to scan")
+p.set_defaults(method=index)
+
+p = subparsers.add_parser('query', help="Print runtime distributions")
+p.add_argument('-p', '--program', help="Program type (raxml, mr_bayes)")
+p.add_argument('-g', '--group-by', default='program_type,nslots,queue', type=_columns,
+               help=f"Comma separated columns to group by, from: {', '.join(JOB_COLUMNS)}")
+p.set_defaults(method=query)
+
+params = parser.parse_args()
+db = RuntimeDB(params.database)
+params.method(db, **vars(params))
+db.close()
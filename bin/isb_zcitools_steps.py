@@ -3,14 +3,15 @@
 import os.path
 import json
 from isabella.environment_desc import get_program_desc
-from isabella.utils import standard_arguments
+from isabella.utils import standard_arguments, submit_jobs, job_dependencies, dependency_waves
 from isabella.processing import check_is_directory_processing, write_processing_status
 
 
-def process(step_names=None, **arguments):
+def process(step_names=None, array_job=False, bundle=False, collect_job=False, **arguments):
     check_is_directory_processing()
 
-    jobs = []
+    # Jobs specified in steps' cluster_run.json, nothing is written before dependencies are checked
+    specs = []  # (program, program_desc, method, step name, job directory, job, name, depends_on)
     for step_name in (step_names or os.listdir('.')):
         if not os.path.isdir(step_name):
             continue
@@ -40,15 +41,69 @@ def process(step_names=None, **arguments):
         for job in data['jobs']:
             _dir = job.get('directory')
             if _dir:
-                cwd = join(step_name, _dir)
+                cwd = os.path.join(step_name, _dir)
                 name = f"{dir_parts[-1]}-{_dir}"
             else:
                 cwd = step_name
                 name = '-'.join(dir_parts[-2:])
-            jobs.append(cwd)
-            method(program, cwd, job, name=name, job_additional_params=program_desc.get_job_additional_params(job), **arguments)
+            # Dependencies of step and of job: step names or job directories (<step>/<directory>)
+            depends_on = list(data.get('depends_on') or []) + list(job.get('depends_on') or [])
+            specs.append((program, program_desc, method, os.path.normpath(step_name), os.path.normpath(cwd), job,
+                          name, depends_on))
+
+    # Check cyclic dependencies between specified jobs
+    spec_steps = dict()  # step name -> list of spec indices
+    for idx, spec in enumerate(specs):
+        spec_steps.setdefault(spec[3], []).append(idx)
+    spec_index = dict((spec[4], idx) for idx, spec in enumerate(specs))
+    spec_dependencies = []
+    for spec in specs:
+        deps = []
+        for ref in spec[7]:
+            ref = os.path.normpath(ref)
+            if ref in spec_steps:
+                deps.extend(spec_steps[ref])
+            elif ref in spec_index:
+                deps.append(spec_index[ref])
+            else:
+                print(f"Warning: job {spec[4]} depends on {ref}, that is not in this processing!")
+        spec_dependencies.append(deps)
+    dependency_waves(spec_dependencies, names=[spec[4] for spec in specs])  # Raises exception on cyclic dependencies
+
+    # Create job scripts
+    jobs = []
+    step_jobs = dict((step_name, []) for step_name in spec_steps)  # step name -> list of job indices
+    references = []  # (job index, list of steps or step/job directories job depends on)
+    for program, program_desc, method, step_name, cwd, job, name, depends_on in specs:
+        j = method(program, cwd, job, name=name,
+                   job_additional_params=program_desc.get_job_additional_params(job), **arguments)
+        created = j if isinstance(j, list) else [j] if j else []
+        for j in created:
+            step_jobs[step_name].append(len(jobs))
+            references.append((len(jobs), depends_on))
+            jobs.append(j)
+
+    # Resolve dependencies into job directories. Split job is referenced by its last (gather) job.
+    job_index = dict((os.path.normpath(j.directory), idx) for idx, j in enumerate(jobs))
+    for idx, depends_on in references:
+        directories = []
+        for ref in depends_on:
+            ref = os.path.normpath(ref)
+            if ref in step_jobs:
+                directories.extend(jobs[i].directory for i in step_jobs[ref])
+            elif ref in job_index:
+                directories.append(jobs[job_index[ref]].directory)
+            elif ref in spec_index:
+                print(f"Warning: job {jobs[idx].directory} depends on {ref}, that was not created!")
+        if directories:
+            jobs[idx] = jobs[idx]._replace(depends_on=tuple(jobs[idx].depends_on or ()) + tuple(directories))
+    dependencies = job_dependencies(jobs)
 
-    write_processing_status(jobs, arguments.get('email'))
+    # Processing status is written before submitting, so that started jobs can find their processing
+    write_processing_status([j.directory for j in jobs], arguments.get('email'), collect_job=collect_job,
+                            dependencies=dependencies)
+    submit_jobs(jobs, array_job=array_job, bundle=bundle, project=arguments.get('project'),
+                email=arguments.get('email'), simulate=arguments.get('simulate'))
 
 
 if __name__ == '__main__':
@@ -57,9 +112,17 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="""
 Run jobs with given zcitools project steps.
 Check zcitools repository (https://github.com/CroP-BioDiv/zcitools).
+Step's cluster_run.json can specify steps or jobs (<step>/<directory>) it depends on with depends_on list,
+on step level or job level. Dependent jobs wait for their dependencies in SGE.
 """)
     parser.add_argument('step_names', nargs='*',
                         help="Project step directories to run. If not set, than all subdirectories are checked.")
+    parser.add_argument('-A', '--array-job', action='store_true',
+                        help="Submit jobs with the same program and queue as one array job")
+    parser.add_argument('-B', '--bundle', action='store_true',
+                        help="Run single CPU jobs bundled in jobs that occupy up to a full node")
+    parser.add_argument('-C', '--collect-job', action='store_true',
+                        help="Collect output in a separate single slot job, not in the last finished job")
     standard_arguments(parser)
 
     process(**vars(parser.parse_args()))
@@ -0,0 +1,7 @@
+#!/usr/bin/python3
+
+import sys
+from isabella.utils import run_bundle
+
+# Arguments are job directories
+run_bundle(sys.argv[1:])
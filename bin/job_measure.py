@@ -0,0 +1,19 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import argparse
+from isabella.monitor import run_measured, SAMPLE_INTERVAL
+
+parser = argparse.ArgumentParser(description="Run command and append its resource usage to job's data.")
+parser.add_argument('-i', '--interval', default=SAMPLE_INTERVAL, type=float,
+                    help=f"Seconds between samples of process tree memory (default {SAMPLE_INTERVAL})")
+parser.add_argument('job_directory', help="Job directory")
+parser.add_argument('command', nargs=argparse.REMAINDER, help="Command to run")
+params = parser.parse_args()
+
+if not params.command:
+    parser.error('No command to run')
+# Scripts created before the journal pass job's status file
+job_directory = params.job_directory if os.path.isdir(params.job_directory) else os.path.dirname(params.job_directory)
+sys.exit(run_measured(params.command, job_directory or '.', interval=params.interval))
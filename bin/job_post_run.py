@@ -1,12 +1,10 @@
 #!/usr/bin/python3
 
-import os.path
 import datetime
 from isabella.utils import on_finish_job
-from isabella.processing import JOB_FILENAME
+from isabella.journal import append_job_status
 
 
-with open(JOB_FILENAME, 'a') as _out:
-    _out.write(f'ended: {datetime.datetime.now()}\n')
+append_job_status(dict(ended=str(datetime.datetime.now())))
 
 on_finish_job()
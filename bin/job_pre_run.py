@@ -4,7 +4,7 @@ import os
 import sys
 import datetime
 from isabella.utils import send_pre_email
-from isabella.processing import JOB_FILENAME
+from isabella.journal import append_job_status
 
 if len(sys.argv) < 2:
     print('No program type specified')
@@ -15,16 +15,25 @@ add_params = None
 if len(sys.argv) > 2:
     add_params = [x.split('=', 1) for x in sys.argv[2].split(':')]
 
-# Note: posao.status is created after checking for mailing
+# Continuation of resubmitted job appends to job status (see utils.resubmit_job())
+segment = os.environ.get('ISABELLA_SEGMENT')
+if segment:
+    data = dict(segment=segment)
+    data[f'segment_started_{segment}'] = str(datetime.datetime.now())
+    for env in ('JOB_ID', 'QUEUE', 'HOSTNAME', 'NSLOTS', 'PE_HOSTFILE'):
+        data[env] = os.environ.get(env, '')
+    append_job_status(data)
+    sys.exit(0)
+
+# Note: job's data is created after checking for mailing
 send_pre_email()
 
-with open(JOB_FILENAME, 'w') as _out:
-    _out.write(f'program_type: {program_type}\n')
-    if add_params:
-        for k, v in add_params:
-            _out.write(f'{k}: {v}\n')
-    _out.write(f'started: {datetime.datetime.now()}\n')
-    # ToDo: Jos neka varijable?
-    for env in ('JOB_ID', 'QUEUE', 'HOSTNAME', 'JOB_NAME', 'NSLOTS',
-                'SGE_TASK_ID', 'SGE_O_HOST', 'SGE_O_PATH', 'SGE_O_WORKDIR', 'PE_HOSTFILE'):
-        _out.write(f"{env}: {os.environ.get(env, '')}\n")
+data = dict(program_type=program_type)
+if add_params:
+    data.update(add_params)
+data['started'] = str(datetime.datetime.now())
+# ToDo: Jos neka varijable?
+for env in ('JOB_ID', 'QUEUE', 'HOSTNAME', 'JOB_NAME', 'NSLOTS',
+            'SGE_TASK_ID', 'SGE_O_HOST', 'SGE_O_PATH', 'SGE_O_WORKDIR', 'PE_HOSTFILE'):
+    data[env] = os.environ.get(env, '')
+append_job_status(data, start=True)
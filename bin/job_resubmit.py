@@ -0,0 +1,7 @@
+#!/usr/bin/python3
+
+# Submits continuation of the job, called from job script when soft runtime limit is reached
+import sys
+from isabella.utils import resubmit_job
+
+sys.exit(0 if resubmit_job() else 1)
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+# Local replacement for qsub, used to test job pipeline without SGE: export ISABELLA_QSUB=local_qsub.py
+# Script is run immediately (synchronously) in current directory, with SGE environment variables set.
+# Supported: -terse, -t <first>-<last>, -pe <pe> <slots>, -v <var>=<value>,..., -hold_jid (ignored, jobs run
+# in submission order), and #$ directives -o, -e, -pe, -t in the script.
+
+import os
+import sys
+import fcntl
+import shlex
+import subprocess
+
+_ID_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'isabella', 'local_qsub.id')
+
+
+def next_job_id():
+    os.makedirs(os.path.dirname(_ID_FILE), exist_ok=True)
+    with open(_ID_FILE, 'a+') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        f.seek(0)
+        job_id = int(f.read().strip() or 0) + 1
+        f.seek(0)
+        f.truncate()
+        f.write(str(job_id))
+    return str(job_id)
+
+
+def parse_args(args, options):
+    # Fills options dict from qsub arguments. Returns not parsed arguments.
+    rest = []
+    args = list(args)
+    while args:
+        a = args.pop(0)
+        if a in ('-o', '-e', '-t', '-hold_jid', '-N', '-P', '-q', '-M', '-m', '-v', '-l'):
+            options[a] = args.pop(0)
+        elif a == '-pe':
+            options[a] = (args.pop(0), args.pop(0))
+        elif a.startswith('-'):
+            options[a] = True
+        else:
+            rest.append(a)
+    return rest
+
+
+args = sys.argv[1:]
+options = dict()
+script = parse_args(args, options)
+if not script:
+    print('Usage: local_qsub.py [options] <script>', file=sys.stderr)
+    sys.exit(1)
+script = script[0]
+
+# Command line options override script directives
+directives = dict()
+with open(script, 'r') as _in:
+    for line in _in:
+        if line.startswith('#$ '):
+            parse_args(shlex.split(line[3:]), directives)
+directives.update(options)
+options = directives
+
+job_id = next_job_id()
+env = dict(os.environ, JOB_ID=job_id, JOB_NAME=options.get('-N', os.path.basename(script)),
+           QUEUE=options.get('-q', 'local.q'), NSLOTS=options.get('-pe', (None, '1'))[1],
+           HOSTNAME=os.uname()[1], SGE_O_WORKDIR=os.getcwd())
+if '-v' in options:
+    env.update(v.split('=', 1) for v in options['-v'].split(',') if '=' in v)
+
+tasks = [None]
+if '-t' in options:
+    first, last = options['-t'].split(':')[0].split('-')
+    tasks = range(int(first), int(last) + 1)
+
+print(f'{job_id}.{options["-t"]}' if '-t' in options else job_id)
+sys.stdout.flush()
+
+for task_id in tasks:
+    if task_id is not None:
+        env['SGE_TASK_ID'] = str(task_id)
+    with open(options.get('-o', 'stdout.out'), 'a') as _out, open(options.get('-e', 'stderr.out'), 'a') as _err:
+        subprocess.run(['bash', script], env=env, stdout=_out, stderr=_err)
@@ -0,0 +1,16 @@
+#!/usr/bin/python3
+
+import argparse
+from isabella.processing import Processing
+
+parser = argparse.ArgumentParser(description="Collect output of processing in current directory.")
+parser.add_argument('-e', '--email', action='store_true', help="Send processing end email, if set in processing")
+params = parser.parse_args()
+
+processing = Processing()
+if not processing.is_processing():
+    print('No processing found!')
+else:
+    processing.collect_output()
+    if params.email:
+        processing.send_post_email()
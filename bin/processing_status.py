@@ -1,5 +1,35 @@
 #!/usr/bin/python3
 
+import argparse
 from isabella.processing import Processing
+from isabella.sge import cached_qstat, QSTAT_TTL
 
-Processing().print_status()
+parser = argparse.ArgumentParser(description="Print status of processing in current directory.")
+parser.add_argument('-l', '--local', action='store_true', help="Check only local files, without querying SGE")
+parser.add_argument('-T', '--qstat-ttl', default=QSTAT_TTL, type=int,
+                    help=f"Seconds for which SGE state is cached (default {QSTAT_TTL})")
+parser.add_argument('-w', '--watch', action='store_true', help="Refresh status periodically, until interrupted")
+parser.add_argument('-i', '--interval', default=60, type=int, help="Watch refresh interval in seconds (default 60)")
+parser.add_argument('-a', '--all', metavar='ROOT', help="Print summary of all processings under ROOT directory")
+parser.add_argument('-s', '--sort', default='eta', choices=('eta', 'failures'),
+                    help="Order of processings in summary (default eta)")
+params = parser.parse_args()
+
+if params.all:
+    from isabella.dashboard import all_summaries, print_summaries
+    sge_states = None if params.local else cached_qstat(ttl=params.qstat_ttl)
+    print_summaries(all_summaries(params.all, sge_states=sge_states), params.all, sort=params.sort)
+else:
+    processing = Processing()
+    if not processing.is_processing():
+        print('No processing found!')
+    else:
+        def sge_states():
+            if not params.local:
+                return cached_qstat(ttl=params.qstat_ttl, not_before=processing.status_file_mtime())
+
+        if params.watch:
+            from isabella.watch import watch
+            watch(processing, interval=params.interval, sge_states_method=sge_states)
+        else:
+            processing.print_status(sge_states=sge_states())
@@ -0,0 +1,194 @@
+"""
+Scaling benchmark of installed programs.
+
+Benchmark is a processing with a grid of jobs: program x test alignment x number of threads x repeat.
+Test alignments are generated (random DNA evolved along a random tree), so benchmark doesn't depend on
+data files. Jobs are run with resource measurement (see monitor.py), so wall time, CPU time and
+peak memory are stored in processing journal. Results are indexed into runtime database, from which
+job generator estimates runtimes and tunes number of threads.
+
+To test benchmark pipeline locally, set ISABELLA_QSUB=local_qsub.py.
+"""
+
+import os
+import random
+from .environment_desc import mpi_process_count
+from .processing import Processing, write_processing_status
+from .runtime_db import job_record, percentile, JOB_COLUMNS
+from .utils import simple_run_script, submit_jobs
+
+# Test alignments (taxa, alignment length)
+STANDARD_ALIGNMENTS = ((20, 1000), (50, 5000), (100, 20000))
+THREAD_COUNTS = (1, 2, 4, 8, 14, 28)
+
+# MrBayes runs in parallel (MPI) at most all chains of all runs
+_MRBAYES_RUNS = 2
+_MRBAYES_CHAINS = 4
+
+_NUCLEOTIDES = 'ACGT'
+_MUTATION_RATE = 0.05
+
+
+def random_alignment(taxa, length, seed=None):
+    # Returns list of (name, sequence). Each sequence is a mutated copy of a random earlier one.
+    rnd = random.Random(seed)
+    sequences = [[rnd.choice(_NUCLEOTIDES) for _ in range(length)]]
+    for _ in range(taxa - 1):
+        seq = list(rnd.choice(sequences))
+        for i in range(length):
+            if rnd.random() < _MUTATION_RATE:
+                seq[i] = rnd.choice(_NUCLEOTIDES)
+        sequences.append(seq)
+    return [(f't{i + 1}', ''.join(s)) for i, s in enumerate(sequences)]
+
+
+def write_phylip(filename, alignment):
+    with open(filename, 'w') as _out:
+        _out.write(f'{len(alignment)} {len(alignment[0][1])}\n')
+        for name, seq in alignment:
+            _out.write(f'{name:<10} {seq}\n')
+
+
+def write_nexus(filename, alignment, result_prefix, ngen):
+    with open(filename, 'w') as _out:
+        _out.write(f"""#NEXUS
+begin data;
+    dimensions ntax={len(alignment)} nchar={len(alignment[0][1])};
+    format datatype=dna missing=? gap=-;
+    matrix
+""")
+        for name, seq in alignment:
+            _out.write(f'    {name:<10} {seq}\n')
+        _out.write(f"""    ;
+end;
+
+begin mrbayes;
+    set autoclose=yes nowarn=yes;
+    lset nst=6 rates=gamma;
+    mcmc ngen={ngen} samplefreq=100 printfreq=100 nruns={_MRBAYES_RUNS} nchains={_MRBAYES_CHAINS} \
+filename={result_prefix};
+    sump;
+    sumt;
+end;
+""")
+
+
+def _job_desc(program_type, bootstraps, seed):
+    # Job description in format of cluster_run.json job
+    if program_type == 'raxml':
+        args = f'-f a -x {seed} -p {seed} -N {bootstraps} -m GTRGAMMA -s alignment.phy -n raxml_output'
+        return dict(single=args, threads='-T {num_threads} ' + args)
+    if program_type == 'mr_bayes':
+        return dict(single='alignment.nex', threads='alignment.nex', result_prefix='result')
+
+
+def parse_alignments(text):
+    # Format: <taxa>x<length>,...
+    return tuple(tuple(int(x) for x in a.split('x')) for a in text.split(','))
+
+
+def _used_thread_counts(program_type, thread_counts):
+    # Thread counts that program actually uses differently. MrBayes uses number of processes that divides
+    # number of its chains, so other counts would repeat the same runs.
+    if program_type != 'mr_bayes':
+        return thread_counts
+    used = dict()
+    for n in thread_counts:
+        used.setdefault(mpi_process_count(_MRBAYES_RUNS * _MRBAYES_CHAINS, n), n)
+    return sorted(used.values())
+
+
+def create_benchmark(directory, program_types=('raxml', 'mr_bayes'), thread_counts=THREAD_COUNTS,
+                     alignments=STANDARD_ALIGNMENTS, repeats=1, bootstraps=100, ngen=100000,
+                     array_job=False, project=None, email=None, simulate=False):
+    # Creates benchmark processing in directory (that shouldn't exist) and submits its jobs
+    os.makedirs(directory)
+    current_dir = os.getcwd()
+    os.chdir(directory)
+    try:
+        jobs = []
+        for taxa, length in alignments:
+            alignment = random_alignment(taxa, length, seed=taxa * length)
+            for program_type in program_types:
+                for num_threads in _used_thread_counts(program_type, thread_counts):
+                    for r in range(repeats):
+                        j_dir = f'{program_type}_{taxa}x{length}_t{num_threads}_r{r + 1}'
+                        os.makedirs(j_dir)
+                        job_desc = _job_desc(program_type, bootstraps, 12345 + r)
+                        if program_type == 'mr_bayes':
+                            write_nexus(os.path.join(j_dir, 'alignment.nex'), alignment,
+                                        job_desc['result_prefix'], ngen)
+                            params = dict(result_prefix=job_desc['result_prefix'])
+                        else:
+                            write_phylip(os.path.join(j_dir, 'alignment.phy'), alignment)
+                            params = None
+                        j = simple_run_script(program_type, j_dir, job_desc, name=f'bench-{j_dir}',
+                                              project=project, email=email, num_threads=num_threads,
+                                              job_additional_params=params, simulate=simulate,
+                                              sample_interval=10)
+                        if j:
+                            jobs.append(j)
+
+        write_processing_status([j.directory for j in jobs], email)
+        submit_jobs(jobs, array_job=array_job, project=project, email=email, simulate=simulate)
+        return len(jobs)
+    finally:
+        os.chdir(current_dir)
+
+
+# ---------------------------------------------------------
+# Results
+# ---------------------------------------------------------
+_Column = dict((c, i) for i, c in enumerate(JOB_COLUMNS))
+
+
+def benchmark_results(directory):
+    # Returns dict (program_type, taxa, alignment_length, nslots) -> list of job records of finished jobs.
+    # Input size is taken from job directory name, since all programs don't report it.
+    processing = Processing(directory)
+    results = dict()
+    for j_dir, job_data in processing.job_directories_with_data():
+        if not job_data:
+            continue
+        record = job_record(os.path.join(processing.directory, j_dir), job_data)
+        if record[_Column['seconds']] is None:
+            continue
+        taxa, length = (int(x) for x in j_dir.split('_')[-3].split('x'))
+        key = (record[_Column['program_type']], taxa, length, record[_Column['nslots']])
+        results.setdefault(key, []).append(record)
+    return results
+
+
+def _median(records, column):
+    values = sorted(r[_Column[column]] for r in records if r[_Column[column]] is not None)
+    return percentile(values, 0.5)
+
+
+def scaling_table(results):
+    # Returns list of rows: (program_type, taxa, alignment_length, nslots, runs, median wall seconds,
+    # median CPU seconds, median peak memory kB, speedup, parallel efficiency, CPU efficiency).
+    # Speedup and efficiency are relative to the smallest measured number of threads of the same input.
+    rows = []
+    bases = dict()
+    for key in sorted(results):
+        records = results[key]
+        program_type, taxa, length, nslots = key
+        seconds = _median(records, 'seconds')
+        cpu = _median(records, 'cpu_seconds')
+        base = bases.setdefault((program_type, taxa, length), (nslots, seconds))
+        speedup = base[1] / seconds if seconds else None
+        efficiency = speedup * base[0] / nslots if speedup else None
+        cpu_efficiency = cpu / (seconds * nslots) if cpu and seconds else None
+        rows.append((program_type, taxa, length, nslots, len(records), seconds, cpu,
+                     _median(records, 'max_rss_kb'), speedup, efficiency, cpu_efficiency))
+    return rows
+
+
+def store_results(directory, database=None):
+    # Indexes benchmark jobs into runtime database. Returns number of indexed jobs.
+    from .runtime_db import RuntimeDB, RUNTIME_DB
+    db = RuntimeDB(database or RUNTIME_DB)
+    try:
+        return db.index([directory])
+    finally:
+        db.close()
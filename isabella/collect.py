@@ -0,0 +1,182 @@
+"""
+Collecting of processing output files into a zip archive.
+
+Members are deflated in parallel (zlib releases GIL, so threads are enough), into temporary
+files in $TMPDIR. Already compressed file types are stored. Manifest of collected files (size, mtime)
+is kept next to the archive, so re-collection compresses only new or changed files:
+ - if files were only added, they are appended to existing archive,
+ - otherwise archive is rewritten with unchanged members copied in compressed form.
+"""
+
+import os
+import json
+import time
+import shutil
+import struct
+import tempfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT
+
+_STORED_EXTENSIONS = ('.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.png', '.jpg', '.jpeg', '.pdf')
+_COMPRESS_LEVEL = 6
+_BLOCK_SIZE = 1 << 20
+
+# Local file header is 30 bytes, followed with filename and extra field
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+
+
+def num_workers():
+    # Number of slots given by SGE, or number of cores
+    return int(os.environ.get('NSLOTS') or os.cpu_count() or 1)
+
+
+def _manifest_filename(zip_filename):
+    return os.path.splitext(zip_filename)[0] + '.manifest'
+
+
+def _read_manifest(zip_filename):
+    # Manifest is valid only if archive wasn't changed after it was written
+    try:
+        with open(_manifest_filename(zip_filename), 'r') as _in:
+            manifest = json.load(_in)
+        if manifest['zip_size'] == os.path.getsize(zip_filename):
+            return manifest['files']
+    except (OSError, ValueError, KeyError):
+        pass
+
+
+def _write_manifest(zip_filename, files):
+    with open(_manifest_filename(zip_filename), 'w') as _out:
+        json.dump(dict(zip_size=os.path.getsize(zip_filename), files=files), _out, indent=1)
+
+
+def _zip_info(filename, st, compress_type):
+    zinfo = ZipInfo(filename, time.localtime(max(st.st_mtime, 315532800))[:6])  # Zip dates start in 1980
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    zinfo.compress_type = compress_type
+    return zinfo
+
+
+def _deflate(filename, tmp_dir):
+    # Returns (temporary file with raw deflate stream, CRC, uncompressed size)
+    compressor = zlib.compressobj(_COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    crc = size = 0
+    fd, tmp_filename = tempfile.mkstemp(dir=tmp_dir)
+    with open(filename, 'rb') as _in, os.fdopen(fd, 'wb') as _out:
+        while True:
+            block = _in.read(_BLOCK_SIZE)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            size += len(block)
+            _out.write(compressor.compress(block))
+        _out.write(compressor.flush())
+    return tmp_filename, crc, size
+
+
+def _copy_bytes(src, dest, length):
+    while length > 0:
+        block = src.read(min(_BLOCK_SIZE, length))
+        if not block:
+            break
+        dest.write(block)
+        length -= len(block)
+
+
+# Writing of compressed data uses zipfile internals, checked with Python 3.6 - 3.13.
+# Without them members are compressed and copied with public ZipFile methods, in one thread.
+_ZIPFILE_INTERNALS = ('fp', 'start_dir', 'filelist', 'NameToInfo', '_didModify')
+
+
+def _raw_write_supported(zf):
+    return all(hasattr(zf, a) for a in _ZIPFILE_INTERNALS) and hasattr(ZipInfo, 'FileHeader')
+
+
+def _write_raw(zf, zinfo, src):
+    # Writes member which data is already compressed. zinfo has set CRC, sizes and compression.
+    zinfo.flag_bits &= ~0x08  # Sizes are known, no data descriptor
+    zf.fp.seek(zf.start_dir)
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader(zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT))
+    _copy_bytes(src, zf.fp, zinfo.compress_size)
+    zf.start_dir = zf.fp.tell()
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    zf._didModify = True
+
+
+def _copy_member(zf, old_info, old_fp):
+    old_fp.seek(old_info.header_offset)
+    header = _LOCAL_HEADER.unpack(old_fp.read(_LOCAL_HEADER.size))
+    old_fp.seek(header[10] + header[11], os.SEEK_CUR)  # Filename and extra lengths
+    zinfo = ZipInfo(old_info.filename, old_info.date_time)
+    for attr in ('compress_type', 'external_attr', 'CRC', 'file_size', 'compress_size'):
+        setattr(zinfo, attr, getattr(old_info, attr))
+    _write_raw(zf, zinfo, old_fp)
+
+
+def _recompress_member(zf, old_zip, old_info):
+    zinfo = ZipInfo(old_info.filename, old_info.date_time)
+    zinfo.compress_type, zinfo.external_attr = old_info.compress_type, old_info.external_attr
+    with old_zip.open(old_info) as _in, zf.open(zinfo, 'w') as _out:
+        shutil.copyfileobj(_in, _out, _BLOCK_SIZE)
+
+
+def collect_files(zip_filename, filenames, workers=None):
+    # Stores files (paths relative to current directory) into zip archive.
+    # Returns number of (re)compressed files.
+    stats = dict()
+    for f in filenames:
+        if os.path.isfile(f) and f not in stats:
+            stats[f] = os.stat(f)
+    current = dict((f, [st.st_size, st.st_mtime]) for f, st in stats.items())
+
+    manifest = _read_manifest(zip_filename) if os.path.isfile(zip_filename) else None
+    if manifest is None:
+        mode, changed = 'w', list(current)
+    else:
+        changed = [f for f, v in current.items() if manifest.get(f) != v]
+        if not changed and not set(manifest) - set(current):
+            return 0
+        # Only new files can be appended, changed or removed files require rewrite
+        mode = 'a' if not set(manifest) - set(current) and all(f not in manifest for f in changed) else 'w'
+    changed_set = set(changed)
+
+    tmp_dir = tempfile.mkdtemp(prefix='isabella_collect_')
+    out_filename = zip_filename if mode == 'a' or manifest is None else zip_filename + '.tmp'
+    old_zip = ZipFile(zip_filename, 'r') if mode == 'w' and manifest is not None else None
+    try:
+        with ZipFile(out_filename, mode) as zf, ThreadPoolExecutor(max_workers=workers or num_workers()) as executor:
+            raw = _raw_write_supported(zf)
+            deflated = dict((f, executor.submit(_deflate, f, tmp_dir)) for f in changed
+                            if raw and not f.lower().endswith(_STORED_EXTENSIONS))
+            old_fp = open(zip_filename, 'rb') if old_zip else None
+            for f, st in stats.items():
+                if f not in changed_set:
+                    if old_zip and raw:
+                        _copy_member(zf, old_zip.getinfo(f), old_fp)
+                    elif old_zip:
+                        _recompress_member(zf, old_zip, old_zip.getinfo(f))
+                elif f in deflated:
+                    tmp_filename, crc, size = deflated[f].result()
+                    zinfo = _zip_info(f, st, ZIP_DEFLATED)
+                    zinfo.CRC, zinfo.file_size = crc, size
+                    zinfo.compress_size = os.path.getsize(tmp_filename)
+                    with open(tmp_filename, 'rb') as _in:
+                        _write_raw(zf, zinfo, _in)
+                    os.remove(tmp_filename)
+                else:
+                    zf.write(f, compress_type=(ZIP_STORED if f.lower().endswith(_STORED_EXTENSIONS) else
+                                               ZIP_DEFLATED))
+            if old_fp:
+                old_fp.close()
+    finally:
+        if old_zip:
+            old_zip.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if out_filename != zip_filename:
+        os.replace(out_filename, zip_filename)
+    _write_manifest(zip_filename, current)
+    return len(changed)
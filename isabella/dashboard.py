@@ -0,0 +1,164 @@
+"""
+Summary of all processings under a directory tree.
+
+Processing directories are found by an incremental scan, indexed in a file per user. For each scanned directory
+the index stores its mtime and subdirectories. Directory mtime changes only when entries are added or removed,
+so directories with unchanged mtime are only stat-ed, not listed again. Processing directories are not scanned
+below, since their job directories are listed in processing journal. Hidden directories are skipped.
+
+Processings are summarized concurrently with a thread pool, since on a shared filesystem time is spent
+waiting for file reads. Summaries of finished processings are kept in the index and reused while
+their journal doesn't change.
+"""
+
+import os
+import json
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from .journal import open_journal, JOURNAL_FILENAME, PROCESSING_FILENAME
+from .processing import Processing
+from .environment_desc import lasted_seconds
+from .file_utils import CACHE_DIR, write_json_file
+
+DIRECTORY_INDEX = os.path.join(CACHE_DIR, 'processings.json')
+SUMMARY_WORKERS = 16
+
+# eta: seconds until the last running job finishes, None if not known
+_Summary = namedtuple('_Summary', 'directory, jobs, finished, running, waiting, failed, eta')
+
+
+def _load_index(index_file):
+    try:
+        with open(index_file, 'r') as _in:
+            return json.load(_in)
+    except (OSError, ValueError):
+        return dict()
+
+
+def scan_processings(root, dirs):
+    # Returns list of processing directories under root.
+    # dirs: index of directories, path -> [mtime, subdirectories, is processing]. It is updated in place.
+    root = os.path.abspath(root)
+    found, seen = [], set()
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            mtime = os.stat(d).st_mtime
+        except OSError:
+            continue
+        seen.add(d)
+        entry = dirs.get(d)
+        if not entry or entry[0] != mtime:
+            try:
+                entries = list(os.scandir(d))
+            except OSError:
+                continue
+            names = set(e.name for e in entries)
+            is_processing = JOURNAL_FILENAME in names or PROCESSING_FILENAME in names
+            subdirs = [] if is_processing else \
+                sorted(e.name for e in entries if not e.name.startswith('.') and e.is_dir(follow_symlinks=False))
+            entry = dirs[d] = [mtime, subdirs, is_processing]
+        if entry[2]:
+            found.append(d)
+        else:
+            stack.extend(os.path.join(d, s) for s in entry[1])
+
+    # Removed directories
+    for d in [d for d in dirs if (d == root or d.startswith(root + os.sep)) and d not in seen]:
+        del dirs[d]
+    return sorted(found)
+
+
+def _journal_signature(directory):
+    journal = open_journal(directory)
+    try:
+        st = os.stat(journal.filename)
+        return [st.st_mtime, st.st_size]
+    except (AttributeError, OSError):
+        return None
+
+
+def summarize(directory, sge_states=None):
+    # Returns _Summary of processing. Jobs are failed if they ended with non zero exit code, are in SGE error
+    # state, or vanished from SGE before they ended.
+    processing = Processing(directory)
+    if not processing.is_processing():
+        return
+    jobs = finished = running = waiting = failed = 0
+    eta, eta_known = 0, True
+    for _, job_data, status in processing.job_statuses(sge_states=sge_states):
+        jobs += 1
+        if job_data and job_data.get('ended'):
+            finished += 1
+        if status.state == 'failed':
+            failed += 1
+        elif status.state == 'waiting':
+            waiting += 1
+        elif status.state == 'running':
+            running += 1
+            if status.eta is not None:
+                eta = max(eta, status.eta)
+            else:
+                eta_known = False
+    return _Summary(processing.directory, jobs, finished, running, waiting, failed,
+                    (eta if eta_known else None) if running else 0)
+
+
+def all_summaries(root, sge_states=None, workers=SUMMARY_WORKERS, index_file=DIRECTORY_INDEX):
+    # Returns list of _Summary of all processings under root
+    index = _load_index(index_file)
+    directories = scan_processings(root, index.setdefault('dirs', dict()))
+    cached = index.setdefault('summaries', dict())
+
+    def _summary(d):
+        signature = _journal_signature(d)
+        c = cached.get(d)
+        if c and signature and c[0] == signature:
+            return signature, _Summary(**c[1])
+        try:
+            return signature, summarize(d, sge_states)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error: reading processing {d}! {e}")
+            return signature, None
+
+    if directories:
+        with ThreadPoolExecutor(max_workers=min(workers, len(directories))) as executor:
+            results = list(executor.map(_summary, directories))
+    else:
+        results = []
+
+    # Only finished processings are cached, status of others depends on SGE and progress of running jobs
+    for d in [d for d in cached if d not in directories]:
+        del cached[d]
+    for signature, s in results:
+        if s and signature and s.finished == s.jobs:
+            cached[s.directory] = [signature, s._asdict()]
+        elif s:
+            cached.pop(s.directory, None)
+    write_json_file(index_file, index)
+    return [s for _, s in results if s]
+
+
+def _eta_str(s):
+    if not s.running:
+        return '-' if s.waiting else 'done'
+    return lasted_seconds(int(s.eta)) if s.eta is not None else '?'
+
+
+def print_summaries(summaries, root, sort='eta'):
+    # sort: eta (processings that finish sooner first, finished processings last) or failures
+    if sort == 'failures':
+        summaries = sorted(summaries, key=lambda s: (-s.failed, s.directory))
+    else:
+        summaries = sorted(summaries, key=lambda s: (s.finished == s.jobs, not s.running, s.eta is None, s.eta or 0,
+                                                     s.directory))
+    root = os.path.abspath(root)
+    names = [os.path.relpath(s.directory, root) for s in summaries]
+    width = max([len(n) for n in names] + [len('Processing')])
+    print(f"{'Processing':<{width}}  {'Jobs':>5} {'Done':>5} {'Run':>5} {'Wait':>5} {'Fail':>5}  ETA")
+    for name, s in zip(names, summaries):
+        print(f"{name:<{width}}  {s.jobs:5} {s.finished:5} {s.running:5} {s.waiting:5} {s.failed:5}  {_eta_str(s)}")
+    if summaries:
+        totals = [sum(getattr(s, f) for s in summaries) for f in ('jobs', 'finished', 'running', 'waiting', 'failed')]
+        print(f"{'Total':<{width}}  " + ' '.join(f'{t:5}' for t in totals))
@@ -4,8 +4,8 @@ Module describes environment of cluster Isabella. Environment consists of:
 * properties of installed programs (multhithreaded, MPI, vector instuctions (AVX, AVX2))
 """
 
+import os
 from os.path import join
-import shutil
 from collections import namedtuple
 
 _ISABELLA_MAIN_DIR = '/home/aturudic/Isabella'
@@ -43,21 +43,25 @@ def lasted_seconds(lasted):
 
 # Description of cluster queues
 # https://wiki.srce.hr/display/RKI/Redovi+poslova+i+paralelne+okoline
+# cpus and memory_gb are per node. MPI jobs (mpi, mpifull) can span nodes, mpifull uses only full nodes.
 _Queue = namedtuple('_Queue', 'queue, parallel, cpus, memory_gb, max_days, flags')
+_NUM_NODES = 76
+_MPI_PARALLEL = ('mpi', 'mpifull')
+_P28_FLAGS = ('SSE3', 'AVX', 'AVX2')  # Haswell, no AVX-512
 _QUEUES = [
     # 76 x Lenovo NeXtScale nx360 M5
     # 2 x Intel Xeon E5-2683 v3
     # 128 GB RAM
     # 1 x 1 TB diskovnog prostora
-    _Queue('p28.q', 'single', 1, 128, 7, ('AVX2',)),
-    _Queue('p28.q', 'threads', 28, 128, 7, ('AVX2',)),
-    _Queue('p28.q', 'mpi', 28, 128, 7, ('AVX2',)),
-    _Queue('p28.q', 'mpifull', 28, 128, 7, ('AVX2',)),
+    _Queue('p28.q', 'single', 1, 128, 7, _P28_FLAGS),
+    _Queue('p28.q', 'threads', 28, 128, 7, _P28_FLAGS),
+    _Queue('p28.q', 'mpi', 28, 128, 7, _P28_FLAGS),
+    _Queue('p28.q', 'mpifull', 28, 128, 7, _P28_FLAGS),
     #
-    _Queue('p28-long.q', 'single', 28, 128, 30, ('AVX2',)),
-    _Queue('p28-long.q', 'threads', 28, 128, 30, ('AVX2',)),
-    _Queue('p28-long.q', 'mpi', 28, 128, 30, ('AVX2',)),
-    _Queue('p28-long.q', 'mpifull', 28, 128, 30, ('AVX2',)),
+    _Queue('p28-long.q', 'single', 28, 128, 30, _P28_FLAGS),
+    _Queue('p28-long.q', 'threads', 28, 128, 30, _P28_FLAGS),
+    _Queue('p28-long.q', 'mpi', 28, 128, 30, _P28_FLAGS),
+    _Queue('p28-long.q', 'mpifull', 28, 128, 30, _P28_FLAGS),
 
     # ToDo: Trebaju li nam uopce drugi redovi?
 ]
@@ -68,64 +72,131 @@ _Program = namedtuple('_Program', 'program, directory, parallel, flags, modules'
 _RAxML_DIR = join(_ISABELLA_PROGRAMS_DIR, 'RAxML', 'bin')
 _MrBayes_DIR = join(_ISABELLA_PROGRAMS_DIR, 'MrBayes', 'bin')
 
+# Variants of a program with the same parallel type are listed from the fastest to the slowest.
+# The fastest variant that is installed and supported by the target queue is used.
 _PROGRAMS = dict(
     raxml=[
         _Program('raxmlHPC-AVX2', _RAxML_DIR, 'single', ('AVX2',), None),
-        _Program('raxmlHPC-PTHREADS-AVX2', _RAxML_DIR, 'threads', ('AVX2',), None)
+        _Program('raxmlHPC-AVX', _RAxML_DIR, 'single', ('AVX',), None),
+        _Program('raxmlHPC-SSE3', _RAxML_DIR, 'single', ('SSE3',), None),
+        _Program('raxmlHPC', _RAxML_DIR, 'single', (), None),
+        _Program('raxmlHPC-PTHREADS-AVX2', _RAxML_DIR, 'threads', ('AVX2',), None),
+        _Program('raxmlHPC-PTHREADS-AVX', _RAxML_DIR, 'threads', ('AVX',), None),
+        _Program('raxmlHPC-PTHREADS-SSE3', _RAxML_DIR, 'threads', ('SSE3',), None),
+        _Program('raxmlHPC-PTHREADS', _RAxML_DIR, 'threads', (), None),
     ],
     mr_bayes=[
         _Program('mr_bayes', _MrBayes_DIR, 'single', ('AVX2',), None),
-        _Program('mr_bayes_mpi', _MrBayes_DIR, 'threads', ('AVX2',), ['mpi/openmpi31-intel-x86_64'])
+        _Program('mr_bayes_mpi', _MrBayes_DIR, 'mpi', ('AVX2',), ['mpi/openmpi31-intel-x86_64'])
     ],
 )
 
-# # Check do program exist and fix data
-# for prs in _PROGRAMS.values():
-#     to_remove = []
-#     for i, p in enumerate(prs):
-#         exe = join(p.directory, p.program)
-#         if not shutil.which(exe):
-#             print(f'Warning: program {exe} is not executable!')
-#             to_remove.append(i)
-#     for i in reversed(to_remove):
-#         prs.pop(i)
+_environment = None
+
+
+def environment():
+    # Cached probe of installed programs (see probe.py)
+    global _environment
+    if _environment is None:
+        from .probe import cached_probe
+        _environment = cached_probe([(p.directory, p.program) for prs in _PROGRAMS.values() for p in prs])
+    return _environment
 
 
 # ---------------------------------------------------------
 # Methods
 # ---------------------------------------------------------
-def get_queue(parallel, num_cpus, flags):
-    for q in _QUEUES:
-        if q.parallel == parallel and all(f in q.flags for f in flags):
-            return q
+def get_queue(parallel, num_cpus, flags, runtime_days=None, memory_gb=None):
+    # Returns the cheapest queue (with the shortest time limit) that fits job's requirements.
+    # Runtime and memory are checked if specified.
+    queues = [q for q in _QUEUES
+              if q.parallel == parallel and q.cpus * (_NUM_NODES if parallel in _MPI_PARALLEL else 1) >= num_cpus and
+              all(f in q.flags for f in flags) and
+              (runtime_days is None or q.max_days >= runtime_days) and
+              (memory_gb is None or q.memory_gb >= memory_gb)]
+    return min(queues, key=lambda q: q.max_days) if queues else None
+
+
+def max_queue_days():
+    return max(q.max_days for q in _QUEUES)
+
+
+def max_queue_memory_gb():
+    return max(q.memory_gb for q in _QUEUES)
+
+
+def get_programs(program, parallel):
+    # Installed variants of a program, from the fastest. If no variant is installed (not on the cluster),
+    # all variants are returned.
+    variants = [p for p in _PROGRAMS.get(program, []) if parallel == p.parallel]
+    installed = set(environment()['installed'])
+    return [p for p in variants if p.program in installed] or variants
+
+
+def program_types():
+    # Program types with described variants
+    return list(_PROGRAMS)
+
+
+def program_parallels(program_type):
+    # Parallel types (single, threads, mpi) of program's variants
+    return sorted(set(p.parallel for p in _PROGRAMS.get(program_type, [])))
 
 
 def get_program(program, parallel):
-    for p in _PROGRAMS.get(program, []):
-        if parallel == p.parallel:
-            return p
+    programs = get_programs(program, parallel)
+    return programs[0] if programs else None
+
+
+def _program_and_queue(program_type, parallel, queue_parallel, num_cpus, runtime_days, memory_gb):
+    # The fastest program variant that has a queue with its vector instructions
+    for p in get_programs(program_type, parallel):
+        queue = get_queue(queue_parallel, num_cpus, p.flags, runtime_days, memory_gb)
+        if queue:
+            return p, queue
+    return None, None
+
+
+def mpi_parallel(num_processes):
+    # Parallel environment for MPI job: full nodes if processes fill them
+    node_cpus = max(q.cpus for q in _QUEUES if q.parallel == 'mpifull')
+    return 'mpifull' if num_processes % node_cpus == 0 else 'mpi'
+
 
+def mpi_process_count(num_parts, num_threads):
+    # Number of MPI processes for a job with num_parts units of parallel work (MrBayes chains) and requested
+    # number of threads: the largest number of processes, up to number of threads, that divides the work evenly
+    return max(n for n in range(1, max(1, min(num_parts, num_threads)) + 1) if num_parts % n == 0)
 
-def get_program_and_queue(program, num_threads, single_cmd, threads_cmd):
-    queue = None
+
+def get_program_and_queue(program_type, num_threads, single_cmd, threads_cmd, runtime_days=None, memory_gb=None,
+                          mpi_processes=None):
+    # runtime_days: method that returns estimated runtime (in days) for given number of threads, or None
+    # mpi_processes: number of processes if program has MPI version, default num_threads.
+    # MPI version takes command line of single (or threaded) version. It is not used for one process.
+    program = queue = None
+
+    def _runtime(nt):
+        return runtime_days(nt) if runtime_days else None
+
+    # Try MPI
+    num_processes = mpi_processes or num_threads
+    if num_threads > 1 and num_processes > 1 and (single_cmd or threads_cmd):
+        program, queue = _program_and_queue(program_type, 'mpi', mpi_parallel(num_processes), num_processes,
+                                            _runtime(num_processes), memory_gb)
 
     # Try multithreaded
-    if num_threads > 1 and threads_cmd:
-        program = get_program(program, 'threads')
-        if program:
-            queue = get_queue('threads', num_threads, program.flags)
+    if not queue and num_threads > 1 and threads_cmd:
+        program, queue = _program_and_queue(program_type, 'threads', 'threads', num_threads, _runtime(num_threads),
+                                            memory_gb)
 
     # Try single CPU
     if not queue and single_cmd:
-        program = get_program(program, 'single')
-        if program:
-            queue = get_queue('single', 1, program.flags)
+        program, queue = _program_and_queue(program_type, 'single', 'single', 1, _runtime(1), memory_gb)
 
     # Backup on threaded version
     if not queue and threads_cmd:
-        program = get_program(program, 'threads')
-        if program:
-            queue = get_queue('single', 1, program.flags)
+        program, queue = _program_and_queue(program_type, 'threads', 'single', 1, _runtime(1), memory_gb)
 
     return (program, queue) if queue else (None, None)
 
@@ -147,8 +218,94 @@ class ProgramDescription:
         raise NotImplementedError(f'Method files_to_zip() is not implemented!')
 
     @staticmethod
-    def status_string(job_directory):
-        return ''
+    def split_job(cwd, job_desc, num_parts):
+        # Splits job into independent parts and a gather job that runs after them.
+        # Returns None if job can't be split, or pair (parts, gather) where parts is a list of
+        # (directory, job description, additional params) and gather is (job description, additional params).
+        # Parts' files_to_zip() should return None, their output is collected by the gather job.
+        return None
+
+    @staticmethod
+    def input_features(job_directory, job_data):
+        # Returns dict with input size features (taxa, alignment_length, patterns) of finished job, if known
+        return None
+
+    @staticmethod
+    def job_input_features(cwd, job_desc):
+        # Returns dict with input size features (taxa, alignment_length) of job to run, if known
+        return None
+
+    @staticmethod
+    def resume_job(cwd, job_desc):
+        # Returns job description that resumes interrupted job from program's checkpoint,
+        # or None if program can't resume.
+        return None
+
+    @staticmethod
+    def estimate_memory_gb(cwd, job_desc):
+        # Estimated peak memory (GB) of a job to run, from its inputs, or None if not known
+        return None
+
+    @staticmethod
+    def mpi_processes(cwd, job_desc):
+        # Number of processes for MPI run of a job, if known
+        return None
+
+    @staticmethod
+    def suggest_num_threads(features, low, high):
+        # Rule of thumb number of threads in range [low, high], used if there are no scaling data
+        return None
+
+    # Status and progress of running job are parsed from a log file.
+    # Program declares log file, regexes to match and number of lines to check from file's head and tail.
+    @staticmethod
+    def progress_file(job_data):
+        # Log file, relative to job directory
+        return None
+
+    @staticmethod
+    def progress_patterns():
+        # List of (state key, regex). Integer value of the first group of the first matching regex is stored.
+        return ()
+
+    @staticmethod
+    def status_lines():
+        # Number of lines, from file's head and tail, that status_string() checks
+        return 0, 10
+
+    @staticmethod
+    def progress(state):
+        # Returns pair (description, fraction of work done or None)
+        return '', None
+
+    @classmethod
+    def parse_progress(cls, state, lines):
+        # Updates progress state (dict) with lines of progress file
+        patterns = cls.progress_patterns()
+        for line in lines:
+            for key, regex in patterns:
+                m = regex.search(line)
+                if m:
+                    state[key] = int(m.group(1))
+                    break
+
+    @classmethod
+    def read_progress(cls, job_directory, job_data=None):
+        # Returns progress() of running job. Only the head and the tail of log file are read, since logs can be large.
+        pf = cls.progress_file(job_data)
+        if not pf:
+            return '', None
+        from .file_utils import head_lines, tail_lines
+        filename = os.path.join(job_directory, pf)
+        num_head, num_tail = cls.status_lines()
+        state = dict()
+        cls.parse_progress(state, head_lines(filename, num_head))
+        cls.parse_progress(state, tail_lines(filename, num_tail))
+        return cls.progress(state)
+
+    @classmethod
+    def status_string(cls, job_directory, job_data=None):
+        return cls.read_progress(job_directory, job_data)[0]
 
 
 def get_program_desc(program_type):
@@ -0,0 +1,51 @@
+import os
+import json
+from itertools import islice
+
+# Per user cache of isabella's indices and probes
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'isabella')
+
+
+def write_json_file(filename, data, indent=None):
+    # Writes JSON file atomically (temporary file is renamed), so concurrent readers don't see a partial file.
+    # Returns False if file can't be written, caches are optional.
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmp_file = f'{filename}.{os.getpid()}'
+        with open(tmp_file, 'w') as _out:
+            json.dump(data, _out, indent=indent)
+        os.replace(tmp_file, filename)
+        return True
+    except OSError:
+        return False
+
+
+def tail_lines(filename, num_lines, block_size=8192):
+    # Returns last num_lines lines of a file. File is read backwards in blocks,
+    # so cost doesn't depend on file size. Returns empty list if file doesn't exist.
+    if num_lines <= 0:
+        return []
+    try:
+        with open(filename, 'rb') as _in:
+            pos = _in.seek(0, os.SEEK_END)
+            data = b''
+            # One newline more than needed, so that the first returned line is complete
+            while pos > 0 and data.count(b'\n') <= num_lines:
+                size = min(block_size, pos)
+                pos -= size
+                _in.seek(pos)
+                data = _in.read(size) + data
+    except OSError:
+        return []
+    return data.decode(errors='replace').splitlines()[-num_lines:]
+
+
+def head_lines(filename, num_lines):
+    # Returns first num_lines lines of a file. Returns empty list if file doesn't exist.
+    if num_lines <= 0:
+        return []
+    try:
+        with open(filename, 'r', errors='replace') as _in:
+            return [line.rstrip('\n') for line in islice(_in, num_lines)]
+    except OSError:
+        return []
@@ -0,0 +1,288 @@
+"""
+Journal of a processing: append-only file of JSON lines (obrada.journal) in processing directory.
+
+Each line is a record {"time": <timestamp>, "job": <job directory or null>, "data": {key: value, ...}}.
+Records without job describe processing (job directories, email, SGE job IDs, ...), others are job's
+events (start, resource usage, end, ...). Job directory is relative to processing directory.
+Later values of a key override earlier ones. Job's start record (with "start": true) resets job's data,
+so a rerun job doesn't inherit values of the previous run.
+
+Writers append one line under a file lock, so records of concurrently running jobs don't interleave.
+Jobs append without reading the journal. Readers parse only records appended since their previous read,
+so status of a processing is one read of one file, instead of a file per job.
+
+Processings started before the journal have key: value status files, obrada.status in processing
+directory and posao.status in each job directory. LegacyJournal reads and writes them with the same interface.
+"""
+
+import os
+import json
+import time
+
+JOURNAL_FILENAME = 'obrada.journal'
+PROCESSING_FILENAME = 'obrada.status'
+JOB_FILENAME = 'posao.status'
+
+
+def parse_status_lines(lines):
+    # Parses key: value lines of status file. Key ends at the first ':', values can contain ':' (timestamps).
+    data = dict()
+    for line in lines:
+        key, sep, value = line.partition(':')
+        if sep and key.strip():
+            data[key.strip()] = value.strip()
+    return data
+
+
+def read_status_file(filename):
+    # Returns dict of status file, None if file doesn't exist
+    try:
+        with open(filename, 'r') as _in:
+            return parse_status_lines(_in)
+    except FileNotFoundError:
+        return None
+
+
+def _status_lines(data):
+    return ''.join(f'{k}: {v}\n' for k, v in data.items())
+
+
+# Lock file
+# https://stackoverflow.com/questions/489861/locking-a-file-in-python
+try:
+    # Posix based file locking (Linux, Ubuntu, MacOS, etc.)
+    #   Only allows locking on writable files, might cause
+    #   strange results for reading.
+    import fcntl
+
+    def lock_file(f):
+        if f.writable():
+            fcntl.lockf(f, fcntl.LOCK_EX)
+
+    def unlock_file(f):
+        if f.writable():
+            fcntl.lockf(f, fcntl.LOCK_UN)
+except ModuleNotFoundError:
+    # Windows file locking
+    import msvcrt
+
+    def file_size(f):
+        return os.path.getsize(os.path.realpath(f.name))
+
+    def lock_file(f):
+        msvcrt.locking(f.fileno(), msvcrt.LK_RLCK, file_size(f))
+
+    def unlock_file(f):
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, file_size(f))
+
+
+# Class for ensuring that all file operations are atomic, treat
+# initialization like a standard call to 'open' that happens to be atomic.
+# This file opener *must* be used in a "with" block.
+class AtomicOpen:
+    # Open the file with arguments provided by user. Then acquire
+    # a lock on that file object (WARNING: Advisory locking).
+    def __init__(self, path, *args, **kwargs):
+        # Open the file and acquire a lock on the file before operating
+        self.file = open(path, *args, **kwargs)
+        # Lock the opened file
+        lock_file(self.file)
+
+    # Return the opened file object (knowing a lock has been obtained).
+    def __enter__(self, *args, **kwargs):
+        return self.file
+
+    # Unlock the file and close the file object.
+    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
+        # Flush to make sure all buffered contents are written to file.
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        # Release the lock on the file.
+        unlock_file(self.file)
+        self.file.close()
+        # Handle exceptions that may have come up during execution, by
+        # default any exceptions are raised to the user.
+        return exc_type is None
+
+
+class Journal:
+    legacy = False
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.filename = os.path.join(self.directory, JOURNAL_FILENAME)
+        self.processing = dict()
+        self.jobs = dict()  # job directory (relative to processing directory) -> dict
+        self.processing_time = 0  # Time of the last change of processing data
+        self._offset = 0
+
+    def job_key(self, job_directory):
+        # Job directory can be absolute or relative to processing directory
+        return os.path.normpath(os.path.relpath(os.path.join(self.directory, job_directory), self.directory))
+
+    def job_data(self, job_directory):
+        return self.jobs.get(self.job_key(job_directory))
+
+    # Reading
+    def _apply(self, data, changed):
+        for line in data.splitlines():
+            try:
+                record = json.loads(line.decode())
+            except ValueError:
+                # Line of a writer that crashed
+                continue
+            job = record.get('job')
+            if job is None:
+                self.processing.update(record.get('data') or ())
+                self.processing_time = record.get('time') or self.processing_time
+            else:
+                if record.get('start') or job not in self.jobs:
+                    self.jobs[job] = dict()
+                self.jobs[job].update(record.get('data') or ())
+            changed.add(job)
+
+    def _read(self, _in):
+        changed = set()
+        size = os.fstat(_in.fileno()).st_size
+        if size < self._offset:
+            # Journal was rewritten
+            changed.update(self.jobs)
+            changed.add(None)
+            self.processing, self.jobs, self._offset = dict(), dict(), 0
+        _in.seek(self._offset)
+        data = _in.read(size - self._offset)
+        end = data.rfind(b'\n') + 1
+        self._apply(data[:end], changed)
+        self._offset += end
+        return changed
+
+    def reload(self):
+        # Reads records appended since the previous reload.
+        # Returns set of jobs which data changed, None in the set marks change of processing data.
+        try:
+            with open(self.filename, 'rb') as _in:
+                return self._read(_in)
+        except OSError:
+            return set()
+
+    # Writing
+    @staticmethod
+    def _line(data, job=None, start=False):
+        record = dict(time=time.time(), job=job, data=data)
+        if start:
+            record['start'] = True
+        return (json.dumps(record, default=str) + '\n').encode()
+
+    def create(self, data):
+        with open(self.filename, 'wb') as _out:
+            _out.write(self._line(data))
+
+    def append(self, data, job_directory=None, start=False):
+        # Appends processing data, or job's data if job directory is given
+        job = None if job_directory is None else self.job_key(job_directory)
+        with AtomicOpen(self.filename, 'ab') as _out:
+            _out.write(self._line(data, job=job, start=start))
+
+    def update(self, method):
+        # Check-and-set of processing data. Method is called with journal read under the lock, and returns pair
+        # (processing data to append or None, result). Returns result.
+        with AtomicOpen(self.filename, 'ab+') as _f:
+            self._read(_f)
+            data, result = method(self)
+            if data:
+                _f.write(self._line(data))
+            return result
+
+
+class LegacyJournal(Journal):
+    # Key: value status files of processings started before the journal
+    legacy = True
+
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.filename = os.path.join(self.directory, PROCESSING_FILENAME)
+        self._stats = dict()  # filename -> (size, mtime)
+
+    def _job_file(self, job):
+        return os.path.join(self.directory, job, JOB_FILENAME)
+
+    def _changed(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return self._stats.pop(filename, None) is not None
+        if self._stats.get(filename) == (st.st_size, st.st_mtime):
+            return False
+        self._stats[filename] = (st.st_size, st.st_mtime)
+        return True
+
+    def reload(self):
+        # Re-reads changed status files
+        changed = set()
+        if self._changed(self.filename):
+            self.processing = read_status_file(self.filename) or dict()
+            self.processing_time = self._stats[self.filename][1] if self.filename in self._stats else 0
+            changed.add(None)
+        for k, v in self.processing.items():
+            if k.startswith('job_dir_'):
+                job = self.job_key(v)
+                j_file = self._job_file(job)
+                if self._changed(j_file):
+                    data = read_status_file(j_file)
+                    if data is None:
+                        self.jobs.pop(job, None)
+                    else:
+                        self.jobs[job] = data
+                    changed.add(job)
+        return changed
+
+    def create(self, data):
+        with open(self.filename, 'w') as _out:
+            _out.write(_status_lines(data))
+
+    def append(self, data, job_directory=None, start=False):
+        if job_directory is None:
+            with AtomicOpen(self.filename, 'a') as _out:
+                _out.write(_status_lines(data))
+        else:
+            with open(self._job_file(self.job_key(job_directory)), 'w' if start else 'a') as _out:
+                _out.write(_status_lines(data))
+
+    def update(self, method):
+        with AtomicOpen(self.filename, 'r+') as _f:
+            self.processing = parse_status_lines(_f.read().splitlines())
+            data, result = method(self)
+            if data:
+                _f.write(_status_lines(data))
+            return result
+
+
+def open_journal(directory):
+    # Journal of processing in the directory, None if directory is not a processing. Journal is not read.
+    if os.path.isfile(os.path.join(directory, JOURNAL_FILENAME)):
+        return Journal(directory)
+    if os.path.isfile(os.path.join(directory, PROCESSING_FILENAME)):
+        return LegacyJournal(directory)
+
+
+def find_journal(directory='.'):
+    # Journal of processing that directory is in. Directory and up ones are checked.
+    _dir = os.path.abspath(directory)
+    while True:
+        journal = open_journal(_dir)
+        if journal:
+            return journal
+        n_dir = os.path.dirname(_dir)
+        if _dir == n_dir:
+            return
+        _dir = n_dir
+
+
+def append_job_status(data, job_directory='.', start=False):
+    # Appends job's data to its processing journal. Outside of a processing, data is stored in job's status file.
+    journal = find_journal(job_directory)
+    if journal:
+        journal.append(data, job_directory=os.path.abspath(job_directory), start=start)
+    else:
+        with open(os.path.join(job_directory, JOB_FILENAME), 'w' if start else 'a') as _out:
+            _out.write(_status_lines(data))
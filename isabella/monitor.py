@@ -0,0 +1,124 @@
+"""
+Resource monitoring of a job's program.
+
+Program is run as a child process. Its process tree is sampled from /proc every interval seconds,
+for peak resident memory of the whole tree. CPU times are taken from rusage of waited child, and
+read/written bytes from /proc/self/io, since kernel adds I/O of reaped children to their parent.
+Results are appended to job's data in processing journal (see journal.py):
+  cpu_user, cpu_sys     : seconds
+  max_rss_kb            : peak resident memory of the process tree
+  cpu_efficiency        : (cpu_user + cpu_sys) / (wall time * NSLOTS)
+  read_bytes, write_bytes
+  exit_code             : negative signal number if program was killed by a signal
+"""
+
+import os
+import time
+import signal
+import resource
+import subprocess
+
+SAMPLE_INTERVAL = 60  # Seconds
+
+_CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def _read(filename):
+    try:
+        with open(filename, 'r') as _in:
+            return _in.read()
+    except OSError:
+        return ''
+
+
+def _parents():
+    # Returns dict pid -> parent pid of all processes
+    parents = dict()
+    for pid in os.listdir('/proc'):
+        if pid.isdigit():
+            stat = _read(f'/proc/{pid}/stat')
+            if stat:
+                # Process name (2nd field) is in parentheses and can contain spaces
+                parents[int(pid)] = int(stat[stat.rfind(')') + 2:].split()[1])
+    return parents
+
+
+def process_tree(pid):
+    # Returns list of pid and its descendants
+    children = dict()
+    for p, pp in _parents().items():
+        children.setdefault(pp, []).append(p)
+    tree, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        tree.append(p)
+        stack.extend(children.get(p, ()))
+    return tree
+
+
+def rss_kb(pid):
+    # Resident memory of a process in kB, 0 if process doesn't exist
+    for line in _read(f'/proc/{pid}/status').splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+    return 0
+
+
+def io_bytes(pid='self'):
+    # Returns (read_bytes, write_bytes) of storage I/O
+    values = dict(line.split(': ') for line in _read(f'/proc/{pid}/io').splitlines() if ': ' in line)
+    return int(values.get('read_bytes', 0)), int(values.get('write_bytes', 0))
+
+
+class _Monitor:
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.max_rss_kb = 0
+        self.process = None
+
+    def sample(self):
+        if os.path.isdir('/proc'):
+            self.max_rss_kb = max(self.max_rss_kb, sum(rss_kb(p) for p in process_tree(self.process.pid)))
+
+    def _forward_signal(self, signum, frame):
+        if self.process and self.process.poll() is None:
+            self.process.send_signal(signum)
+
+    def run(self, interval):
+        # Runs command and returns dict of measured values
+        start_io = io_bytes()
+        started = time.time()
+        # SGE warning signals are handled by job script. SGE signals the whole process group, and ignored
+        # signals stay ignored in the program.
+        for s in (signal.SIGUSR1, signal.SIGUSR2):
+            signal.signal(s, signal.SIG_IGN)
+        self.process = subprocess.Popen(self.cmd)
+        # Kill signal is passed to the program, measurement is still stored
+        signal.signal(signal.SIGTERM, self._forward_signal)
+        while True:
+            try:
+                self.process.wait(timeout=interval)
+                break
+            except subprocess.TimeoutExpired:
+                self.sample()
+        wall = time.time() - started
+
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        end_io = io_bytes()
+        nslots = int(os.environ.get('NSLOTS') or 1)
+        cpu = usage.ru_utime + usage.ru_stime
+        return dict(cpu_user=f'{usage.ru_utime:.2f}', cpu_sys=f'{usage.ru_stime:.2f}',
+                    max_rss_kb=max(self.max_rss_kb, usage.ru_maxrss),  # Linux reports ru_maxrss in kB
+                    cpu_efficiency=f'{cpu / (wall * nslots):.3f}' if wall > 0 else '',
+                    read_bytes=end_io[0] - start_io[0], write_bytes=end_io[1] - start_io[1],
+                    exit_code=self.process.returncode)
+
+
+def run_measured(cmd, job_directory, interval=SAMPLE_INTERVAL):
+    # Runs command (list of arguments), appends measurement to job's data and returns program's exit code.
+    # Program killed by a signal returns 128 + signal number, as in shell.
+    from .journal import append_job_status
+    measured = _Monitor(cmd).run(interval)
+    append_job_status(measured, job_directory=os.path.abspath(job_directory))
+    code = measured['exit_code']
+    return 128 - code if code < 0 else code
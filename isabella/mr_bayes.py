@@ -1,5 +1,117 @@
+import re
+import shlex
+import os.path
+from .file_utils import head_lines
 from .environment_desc import ProgramDescription
 
+# Lines of MrBayes output (job's stdout)
+#    Setting number of generations to 1000000
+#       1000 -- (-4567.123) (-4570.456) * [-4568.789] (-4569.012) -- 0:23:45
+_num_generations = re.compile(r'Setting number of generations to (\d+)')
+_generation = re.compile(r'^\s*(\d+) -- .* -- \d+:\d\d:\d\d\s*$')
+#    Defining new matrix with 25 taxa and 3000 characters
+_matrix = re.compile(r'Defining new matrix with (\d+) taxa and (\d+) characters')
+# Nexus data block: dimensions ntax=25 nchar=3000;
+_dimensions = re.compile(r'dimensions\s+ntax\s*=\s*(\d+)\s+nchar\s*=\s*(\d+)', re.IGNORECASE)
+# MrBayes block and its commands
+_mrbayes_block = re.compile(r'begin\s+mrbayes\s*;(.*?)end\s*;', re.IGNORECASE | re.DOTALL)
+_nruns = re.compile(r'\bnruns\s*=\s*(\d+)', re.IGNORECASE)
+_nchains = re.compile(r'\bnchains\s*=\s*(\d+)', re.IGNORECASE)
+_seed = re.compile(r'\bseed\s*=\s*(\d+)', re.IGNORECASE)
+_protein = re.compile(r'datatype\s*=\s*protein', re.IGNORECASE)
+_gamma = re.compile(r'\brates\s*=\s*(?:gamma|invgamma|adgamma)', re.IGNORECASE)
+_append = re.compile(r'\s*\bappend\s*=\s*[^\s;]+', re.IGNORECASE)
+_run_settings = re.compile(r'\s*\b(?:nruns|seed|swapseed|filename)\s*=\s*[^\s;]+', re.IGNORECASE)
+
+
+def nexus_file(job_desc):
+    # Nexus file is the command line argument with nexus extension
+    cmd = job_desc.get('threads') or job_desc.get('single') or ''
+    for arg in reversed(cmd.split()):
+        if arg.lower().endswith(('.nex', '.nexus', '.nxs')):
+            return arg
+
+
+def _mrbayes_commands(filename):
+    # Returns (file text, mrbayes block match, list of block's commands), or None
+    if not filename or not os.path.isfile(filename):
+        return
+    with open(filename, 'r') as _in:
+        text = _in.read()
+    m = _mrbayes_block.search(text)
+    if m:
+        return text, m, [c.strip() for c in m.group(1).split(';') if c.strip()]
+
+
+def _mcmc_settings(commands):
+    # Returns (nruns, nchains, seed) set by mcmc and mcmcp commands, with MrBayes defaults
+    settings = dict(nruns=2, nchains=4, seed=12345)
+    for c in commands:
+        if c.split()[0].lower() in ('mcmc', 'mcmcp'):
+            for key, regex in (('nruns', _nruns), ('nchains', _nchains), ('seed', _seed)):
+                m = regex.search(c)
+                if m:
+                    settings[key] = int(m.group(1))
+    return settings['nruns'], settings['nchains'], settings['seed']
+
+
+def _replace_block(text, m, commands):
+    # Returns nexus text with mrbayes block (match m) replaced with given commands
+    return text[:m.start()] + 'begin mrbayes;\n' + ''.join(f'    {c};\n' for c in commands) + 'end;' + text[m.end():]
+
+
+def _split_runs(cwd, job_desc, result_prefix):
+    # Independent runs (nruns) of MrBayes analysis are run as separate jobs in run_<i> subdirectories,
+    # each with nruns=1 and distinct seed. Summary job renames runs' files to names of a multi run analysis
+    # (<prefix>.run<i>.p/.t) and runs sump and sumt on them.
+    nf = nexus_file(job_desc)
+    block = _mrbayes_commands(os.path.join(cwd, nf) if nf else None)
+    if not block:
+        return
+    text, m, commands = block
+    if not any(c.split()[0].lower() == 'mcmc' for c in commands):
+        return
+    num_runs, _, seed = _mcmc_settings(commands)
+    if num_runs < 2:
+        return
+
+    parts = []
+    for i in range(num_runs):
+        cmds = []
+        for c in commands:
+            name = c.split()[0].lower()
+            if name in ('sump', 'sumt', 'quit'):
+                continue
+            if name in ('mcmc', 'mcmcp'):
+                c = _run_settings.sub('', c)
+                if name == 'mcmc':
+                    c += f' nruns=1 seed={seed + i} swapseed={seed + i} filename={result_prefix}'
+            cmds.append(c)
+        part_dir = os.path.join(cwd, f'run_{i + 1}')
+        os.makedirs(part_dir, exist_ok=True)
+        with open(os.path.join(part_dir, os.path.basename(nf)), 'w') as _out:
+            _out.write(_replace_block(text, m, cmds))
+        part_desc = dict(job_desc)
+        for k in ('single', 'threads'):
+            if job_desc.get(k):
+                part_desc[k] = job_desc[k].replace(nf, os.path.basename(nf))
+        parts.append((part_dir, part_desc, dict(mrbayes_run=i + 1)))
+
+    # Summary uses sump/sumt commands of original analysis, if there are any
+    settings = f'filename={result_prefix} nruns={num_runs}'
+    cmds = [c for c in commands if c.split()[0].lower() == 'set']
+    sums = [f'{_run_settings.sub("", c)} {settings}' for c in commands if c.split()[0].lower() in ('sump', 'sumt')]
+    cmds += sums or [f'sump {settings}', f'sumt {settings}']
+    with open(os.path.join(cwd, 'mrbayes_summary.nex'), 'w') as _out:
+        _out.write(_replace_block(text, m, cmds))
+
+    script = ''.join(f"""mv run_{i + 1}/{result_prefix}.p {result_prefix}.run{i + 1}.p
+mv run_{i + 1}/{result_prefix}.t {result_prefix}.run{i + 1}.t
+""" for i in range(num_runs)) + '{exe} mrbayes_summary.nex'
+    gather_desc = dict((k, v) for k, v in job_desc.items() if k not in ('threads', 'runtime_hours'))
+    gather_desc['single'] = 'bash -e -c ' + shlex.quote(script)
+    return parts, (gather_desc, dict(mrbayes_runs=num_runs))
+
 
 class MrBayes(ProgramDescription):
     @staticmethod
@@ -11,29 +123,97 @@ class MrBayes(ProgramDescription):
     def get_job_additional_params(job_data):
         return dict(result_prefix=job_data['result_prefix'])
 
+    @staticmethod
+    def split_job(cwd, job_desc, num_parts):
+        # Job is split into one job per run, num_parts is not used
+        return _split_runs(cwd, job_desc, job_desc['result_prefix'])
+
+    @staticmethod
+    def resume_job(cwd, job_desc):
+        # Resumed analysis continues from checkpoint file (.ckp) with mcmc append=yes.
+        # Nexus file with changed mcmc command is stored next to the original.
+        nf = nexus_file(job_desc)
+        block = _mrbayes_commands(os.path.join(cwd, nf) if nf else None)
+        if not block:
+            return
+        text, m, commands = block
+        commands = [(_append.sub('', c) + ' append=yes') if c.split()[0].lower() == 'mcmc' else c for c in commands]
+        resume_nf = os.path.splitext(nf)[0] + '.resume.nex'
+        with open(os.path.join(cwd, resume_nf), 'w') as _out:
+            _out.write(_replace_block(text, m, commands))
+        resume_desc = dict(job_desc)
+        for k in ('single', 'threads'):
+            if job_desc.get(k):
+                resume_desc[k] = job_desc[k].replace(nf, resume_nf)
+        return resume_desc
+
+    @staticmethod
+    def estimate_memory_gb(cwd, job_desc):
+        # Each chain keeps two copies of conditional likelihoods for nodes of its tree:
+        # 2 * taxa * characters * states * gamma categories * 8 bytes, for each of nruns * nchains chains
+        features = MrBayes.job_input_features(cwd, job_desc)
+        nf = nexus_file(job_desc)
+        block = _mrbayes_commands(os.path.join(cwd, nf) if nf else None)
+        if not features or not block:
+            return
+        text, _, commands = block
+        num_runs, num_chains, _ = _mcmc_settings(commands)
+        states = 20 if _protein.search(text) else 4
+        rates = 4 if any(_gamma.search(c) for c in commands if c.split()[0].lower() == 'lset') else 1
+        chain_bytes = 2 * features['taxa'] * features['alignment_length'] * states * rates * 8
+        return num_runs * num_chains * chain_bytes / 1024 ** 3
+
+    @staticmethod
+    def mpi_processes(cwd, job_desc):
+        # MrBayes distributes chains of all runs over processes
+        nf = nexus_file(job_desc)
+        block = _mrbayes_commands(os.path.join(cwd, nf) if nf else None)
+        if block:
+            num_runs, num_chains, _ = _mcmc_settings(block[2])
+            return num_runs * num_chains
+
     @staticmethod
     def files_to_zip(job_data):
+        if job_data.get('mrbayes_run'):
+            return None
         rp = job_data['result_prefix']
-        return [(rp + e) for e in ('.ckp', '.con.tre', '.parts', '.run1.p', '.run1.t',
-                                   '.run2.p', '.run2.t', '.tstat', '.vstat')]
-
-    # @staticmethod
-    # def status_string(job_directory):
-    #     num_iterations = 1000  # ToDo: find data somewhere
-
-    #     r_o = os.path.join(job_directory, 'RAxML_info.raxml_output')
-    #     if os.path.isfile(r_o):
-    #         with open(r_o, 'r') as _in:
-    #             last_lines = deque(_in, 5)
-    #         # Check lines from the end
-    #         lines = reversed(last_lines)
-    #         for line in lines:
-    #             m = _bootstrap_iteration.search(line)
-    #             if m:
-    #                 num_iter = m.group(1)
-    #                 return f"on iteration {num_iter}/{num_iterations}"
-    #             m = _overall_time.search(line)
-    #             if m:
-    #                 seconds = lasted_seconds(int(m.group(1)))
-    #                 return f"bootstrap time {seconds}"
-    #     return ''
+        runs = [f'.run{i + 1}.{e}' for i in range(int(job_data.get('mrbayes_runs', 2))) for e in 'pt']
+        return [(rp + e) for e in ['.ckp', '.con.tre', '.parts'] + runs + ['.tstat', '.vstat']]
+
+    @staticmethod
+    def input_features(job_directory, job_data):
+        for line in head_lines(os.path.join(job_directory, 'stdout.out'), 500):
+            m = _matrix.search(line)
+            if m:
+                return dict(taxa=int(m.group(1)), alignment_length=int(m.group(2)))
+
+    @staticmethod
+    def job_input_features(cwd, job_desc):
+        nf = nexus_file(job_desc)
+        if nf:
+            for line in head_lines(os.path.join(cwd, nf), 100):
+                m = _dimensions.search(line)
+                if m:
+                    return dict(taxa=int(m.group(1)), alignment_length=int(m.group(2)))
+
+    @staticmethod
+    def progress_file(job_data):
+        return 'stdout.out'
+
+    @staticmethod
+    def progress_patterns():
+        return (('generation', _generation), ('num_generations', _num_generations))
+
+    @staticmethod
+    def status_lines():
+        # Number of generations is set after the header, that lists matrix's taxa and model settings
+        return 1000, 10
+
+    @staticmethod
+    def progress(state):
+        if 'generation' not in state:
+            return '', None
+        num_generations = state.get('num_generations')
+        if num_generations:
+            return f"generation {state['generation']}/{num_generations}", state['generation'] / num_generations
+        return f"generation {state['generation']}", None
@@ -0,0 +1,340 @@
+"""
+Makespan planner for simulated runs (--simulate).
+
+Jobs, with estimated runtimes and slots, are scheduled by a discrete-event simulation of SGE on cluster
+capacity from environment description (nodes x cores, memory per node). Queues share the same nodes.
+Scheduling is simplified SGE without reservations: when slots are released, waiting jobs whose dependencies
+finished are started in submission order, and a job that doesn't fit doesn't block smaller jobs behind it.
+Jobs fit on one node, best fit, except MPI jobs: mpi takes slots from any nodes, mpifull takes whole nodes.
+
+Waiting jobs are grouped by number of slots and parallel environment, so a scheduling pass checks only
+the first job of each group. Events are kept in a heap, and cost is about O(jobs * (log jobs + nodes)).
+
+Runtimes are estimated by the job generator (see utils.plan_runtimes()) for job's slots and, for threaded
+jobs, for other numbers of threads (PLAN_THREADS). Missing estimates are scaled by Amdahl's law.
+Strategies (single CPU or threaded jobs, bundled or separate single CPU jobs) are compared by simulating each.
+Equal strategies are simulated once, and numbers of threads only while makespan improves.
+"""
+
+import os
+import heapq
+from collections import namedtuple
+from .environment_desc import _QUEUES, _NUM_NODES, lasted_seconds
+
+PLAN_THREADS = (1, 2, 4, 7, 14, 28)
+PARALLEL_FRACTION = 0.9  # Amdahl's law, for runtimes not estimated for a number of threads
+DEFAULT_RUNTIME_HOURS = 1  # For jobs without any runtime estimate, if no job has one
+
+# memory_gb is per slot, depends_on are indices of plan jobs
+_PlanJob = namedtuple('_PlanJob', 'name, queue, slots, parallel, memory_gb, hours, depends_on')
+
+_Scheduled = namedtuple('_Scheduled', 'start, end, cause')  # cause: dependency job started after, or None
+
+
+def _cluster():
+    # Returns (number of nodes, cores per node, memory per node)
+    return _NUM_NODES, max(q.cpus for q in _QUEUES), min(q.memory_gb for q in _QUEUES)
+
+
+def _slots(job):
+    # Slots of _Job. SGE gives range of slots (4-8) up to its maximum, if available.
+    nt = job.num_threads
+    if not nt:
+        return 1
+    return int(str(nt).split('-')[-1])
+
+
+def _amdahl(n):
+    return (1 - PARALLEL_FRACTION) + PARALLEL_FRACTION / n
+
+
+def job_runtime(job, slots):
+    # Estimated runtime (hours) of _Job on given number of slots, None if not known
+    runtimes = job.runtimes or dict()
+    if runtimes.get(slots):
+        return runtimes[slots]
+    known = [(n, h) for n, h in runtimes.items() if h]
+    if not known:
+        return None
+    n, h = min(known, key=lambda x: (abs(x[0] - slots), x[0]))
+    return h * _amdahl(slots) / _amdahl(n)
+
+
+def _threadable(job):
+    # Job generator estimated runtimes for planner's numbers of threads
+    return not job.parallel and len(job.runtimes or ()) > 1
+
+
+def _threaded(job):
+    # Number of threads of a job can be changed if runtimes for more numbers of threads are known,
+    # without scaling data runtimes of other numbers of threads would be invented
+    return _threadable(job) and sum(1 for h in job.runtimes.values() if h) > 1
+
+
+# ---------------------------------------------------------
+# Simulation
+# ---------------------------------------------------------
+def simulate(plan_jobs):
+    # Returns list of _Scheduled for plan jobs. Jobs that don't fit the cluster are not started (None).
+    num_nodes, node_cpus, node_memory = _cluster()
+    free = [node_cpus] * num_nodes
+    free_memory = [float(node_memory)] * num_nodes
+    allocations = dict()  # job index -> list of (node, slots)
+
+    num_deps = [len(j.depends_on) for j in plan_jobs]
+    dependents = [[] for _ in plan_jobs]
+    for idx, j in enumerate(plan_jobs):
+        for d in j.depends_on:
+            dependents[d].append(idx)
+    deps_end = [0.] * len(plan_jobs)
+    cause = [None] * len(plan_jobs)
+    scheduled = [None] * len(plan_jobs)
+
+    waiting = dict()  # (slots, parallel) -> heap of job indices
+    events = []  # heap of (end time, job index)
+
+    def _make_ready(idx):
+        j = plan_jobs[idx]
+        heapq.heappush(waiting.setdefault((j.slots, j.parallel), []), idx)
+
+    def _place(j):
+        # Returns list of (node, slots), or None if job doesn't fit now
+        memory = (j.memory_gb or 0) * j.slots
+        if j.parallel == 'mpifull':
+            nodes = [n for n in range(num_nodes) if free[n] == node_cpus]
+            needed = -(-j.slots // node_cpus)
+            return [(n, node_cpus) for n in nodes[:needed]] if len(nodes) >= needed else None
+        if j.parallel == 'mpi':
+            if sum(free) < j.slots:
+                return None
+            placed, rest = [], j.slots
+            for n in sorted(range(num_nodes), key=lambda n: -free[n]):
+                if rest <= 0:
+                    break
+                take = min(rest, free[n])
+                if take:
+                    placed.append((n, take))
+                    rest -= take
+            return placed
+        if j.slots > max(free):
+            return None
+        fits = [n for n in range(num_nodes) if free[n] >= j.slots and free_memory[n] >= memory]
+        return [(min(fits, key=free.__getitem__), j.slots)] if fits else None
+
+    def _schedule(now):
+        # Free resources only decrease while scheduling, so a group which first job doesn't fit stays blocked
+        blocked = set()
+        while True:
+            # The first waiting job, in submission order, that fits
+            keys = [k for k, h in waiting.items() if h and k not in blocked]
+            if not keys:
+                return
+            key = min(keys, key=lambda k: waiting[k][0])
+            idx = waiting[key][0]
+            j = plan_jobs[idx]
+            placed = _place(j)
+            if not placed:
+                blocked.add(key)
+                continue
+            heapq.heappop(waiting[key])
+            for n, s in placed:
+                free[n] -= s
+                free_memory[n] -= (j.memory_gb or 0) * s
+            allocations[idx] = placed
+            scheduled[idx] = _Scheduled(now, now + j.hours, cause[idx])
+            heapq.heappush(events, (now + j.hours, idx))
+
+    for idx, n in enumerate(num_deps):
+        if not n:
+            _make_ready(idx)
+    _schedule(0.)
+    while events:
+        now, idx = heapq.heappop(events)
+        finished = [idx]
+        while events and events[0][0] == now:
+            finished.append(heapq.heappop(events)[1])
+        for idx in finished:
+            j = plan_jobs[idx]
+            for n, s in allocations.pop(idx):
+                free[n] += s
+                free_memory[n] += (j.memory_gb or 0) * s
+            for d in dependents[idx]:
+                num_deps[d] -= 1
+                if now >= deps_end[d]:
+                    deps_end[d], cause[d] = now, idx
+                if not num_deps[d]:
+                    _make_ready(d)
+        _schedule(now)
+    return scheduled
+
+
+def critical_path(scheduled):
+    # Jobs that determine makespan: the last finished job and, backwards, dependencies it started after.
+    # Returns list of job indices, from the first one.
+    ended = [(s.end, idx) for idx, s in enumerate(scheduled) if s]
+    if not ended:
+        return []
+    path = [max(ended)[1]]
+    while scheduled[path[-1]].cause is not None:
+        path.append(scheduled[path[-1]].cause)
+    return path[::-1]
+
+
+# ---------------------------------------------------------
+# Strategies
+# ---------------------------------------------------------
+def _dependencies(jobs):
+    # Returns list of lists of indices of jobs that job depends on
+    index = dict((os.path.normpath(j.directory), idx) for idx, j in enumerate(jobs))
+    return [[index[os.path.normpath(d)] for d in (j.depends_on or ()) if os.path.normpath(d) in index] for j in jobs]
+
+
+def plan_jobs(jobs, bundle=False, threads=None, default_hours=DEFAULT_RUNTIME_HOURS, deps=None):
+    # Converts list of _Job into list of _PlanJob.
+    # threads: number of threads of threaded jobs, if not set jobs are run as they are generated.
+    # If bundle is set, independent single CPU jobs are bundled as in utils.submit_jobs().
+    # deps: dependencies of jobs (_dependencies()), if already resolved
+    if deps is None:
+        deps = _dependencies(jobs)
+    p_jobs = []
+    for j, d in zip(jobs, deps):
+        slots = threads if threads and _threaded(j) else _slots(j)
+        hours = job_runtime(j, slots)
+        p_jobs.append(_PlanJob(j.name or j.directory, j.queue, slots, j.parallel, j.memory_gb,
+                               hours if hours else default_hours, d))
+    if not bundle:
+        return p_jobs
+
+    # Bundles of at most node's cores, per queue. Bundle runs as long as its longest job.
+    node_cpus = _cluster()[1]
+    groups = dict()
+    for idx, (p, d) in enumerate(zip(p_jobs, deps)):
+        if p.slots == 1 and not p.parallel and not d and not jobs[idx].alone:
+            groups.setdefault(p.queue, []).append(idx)
+    member = dict()  # job index -> bundle index
+    bundles = []
+    for queue, idxs in groups.items():
+        if len(idxs) < 2:
+            continue
+        num_bundles = (len(idxs) + node_cpus - 1) // node_cpus
+        for b in range(num_bundles):
+            b_idxs = idxs[b::num_bundles]
+            member.update((i, len(bundles)) for i in b_idxs)
+            bundles.append(b_idxs)
+    if not bundles:
+        return p_jobs
+    new_index = dict()
+    result = []
+    for idx, p in enumerate(p_jobs):
+        if idx in member:
+            continue
+        new_index[idx] = len(result)
+        result.append(p)
+    for b_idxs in bundles:
+        for i in b_idxs:
+            new_index[i] = len(result)
+        memory = [p_jobs[i].memory_gb for i in b_idxs if p_jobs[i].memory_gb]
+        result.append(_PlanJob(f'bundle of {len(b_idxs)}', p_jobs[b_idxs[0]].queue, len(b_idxs), None,
+                               max(memory) if memory else None, max(p_jobs[i].hours for i in b_idxs), []))
+    return [p._replace(depends_on=sorted(set(new_index[d] for d in p.depends_on))) for p in result]
+
+
+_Plan = namedtuple('_Plan', 'strategy, makespan, slot_hours, queue_slot_hours, not_fitting, plan_jobs, scheduled')
+
+
+def make_plan(strategy, p_jobs):
+    scheduled = simulate(p_jobs)
+    queue_slot_hours = dict()
+    for p, s in zip(p_jobs, scheduled):
+        if s:
+            queue_slot_hours[p.queue] = queue_slot_hours.get(p.queue, 0) + p.slots * p.hours
+    return _Plan(strategy, max((s.end for s in scheduled if s), default=0), sum(queue_slot_hours.values()),
+                 queue_slot_hours, sum(1 for s in scheduled if not s), p_jobs, scheduled)
+
+
+def compare_strategies(jobs, bundle=False, default_hours=DEFAULT_RUNTIME_HOURS):
+    # Returns list of _Plan: jobs as generated, and alternative strategies.
+    # Strategies with the same plan jobs (e.g. without bundles formed) are simulated once.
+    # Numbers of threads are tried from the generated one, down and up while makespan improves.
+    seen = dict()  # plan jobs key -> _Plan
+    deps = _dependencies(jobs)
+
+    def _plan(strategy, bundle_, threads):
+        p_jobs = plan_jobs(jobs, bundle_, threads, default_hours, deps=deps)
+        key = tuple((j.slots, j.hours, tuple(j.depends_on)) for j in p_jobs)
+        if key in seen:
+            return seen[key], False
+        plan = seen[key] = make_plan(strategy, p_jobs)
+        return plan, True
+
+    plans = []
+    for strategy, b in (('as generated' + (', bundled' if bundle else ''), bundle),
+                        ('as generated' + ('' if bundle else ', bundled'), not bundle)):
+        plan, new = _plan(strategy, b, None)
+        if new:
+            plans.append(plan)
+
+    threaded = sorted(_slots(j) for j in jobs if _threaded(j))
+    if threaded:
+        median = threaded[len(threaded) // 2]
+        start = min(range(len(PLAN_THREADS)), key=lambda i: abs(PLAN_THREADS[i] - median))
+        thread_plans = dict()  # threads -> _Plan
+        for step in (-1, 1):
+            i, previous = start, None
+            while 0 <= i < len(PLAN_THREADS):
+                threads = PLAN_THREADS[i]
+                plan, new = _plan(f'{threads} thread{"s" if threads > 1 else ""}', False, threads)
+                if new:
+                    thread_plans[threads] = plan
+                if previous is not None and plan.makespan >= previous:
+                    break
+                i, previous = i + step, plan.makespan
+        plans.extend(thread_plans[t] for t in sorted(thread_plans))
+        plan, new = _plan('1 thread, bundled', True, 1)
+        if new:
+            plans.append(plan)
+    return plans
+
+
+def _hours_str(hours):
+    return lasted_seconds(int(hours * 3600))
+
+
+def print_plan(jobs, bundle=False):
+    # Prints expected makespan, utilisation and critical path of jobs, and comparison of strategies
+    if not jobs:
+        return
+    num_nodes, node_cpus, _ = _cluster()
+    known = sorted(h for h in (job_runtime(j, _slots(j)) for j in jobs) if h)
+    default_hours = known[len(known) // 2] if known else DEFAULT_RUNTIME_HOURS
+    plans = compare_strategies(jobs, bundle=bundle, default_hours=default_hours)
+    plan = plans[0]
+    capacity = num_nodes * node_cpus
+
+    print(f"\nPlan on {num_nodes} nodes x {node_cpus} cores, {len(jobs)} jobs")
+    if len(known) < len(jobs):
+        print(f"  {len(jobs) - len(known)} jobs without runtime estimate, assumed {_hours_str(default_hours)}")
+    no_scaling = sum(1 for j in jobs if _threadable(j) and not _threaded(j))
+    if no_scaling:
+        print(f"  {no_scaling} threaded jobs without scaling data, their numbers of threads are not compared")
+    if plan.not_fitting:
+        print(f"  {plan.not_fitting} jobs don't fit on the cluster!")
+    print(f"Expected makespan: {_hours_str(plan.makespan)}")
+    if plan.makespan:
+        for queue, sh in sorted(plan.queue_slot_hours.items()):
+            print(f"  {queue}: utilisation {100 * sh / (capacity * plan.makespan):.1f}%, {sh:.1f} slot hours")
+
+    path = critical_path(plan.scheduled)
+    print("Critical path:")
+    for idx in path:
+        p, s = plan.plan_jobs[idx], plan.scheduled[idx]
+        ready = plan.scheduled[s.cause].end if s.cause is not None else 0
+        waited = f", waited {_hours_str(s.start - ready)} for slots" if s.start > ready else ''
+        print(f"  {p.name}: {_hours_str(s.start)} - {_hours_str(s.end)} on {p.slots} slots{waited}")
+
+    print("Strategies:")
+    width = max(len(p.strategy) for p in plans)
+    print(f"  {'Strategy':<{width}}  {'Makespan':>9}  {'Utilisation':>11}  {'Slot hours':>10}")
+    for p in plans:
+        utilisation = 100 * p.slot_hours / (capacity * p.makespan) if p.makespan else 0
+        print(f"  {p.strategy:<{width}}  {_hours_str(p.makespan):>9}  {utilisation:10.1f}%  {p.slot_hours:10.1f}")
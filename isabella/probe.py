@@ -0,0 +1,49 @@
+"""
+Probe of the environment: installed program binaries.
+
+Checking binaries on shared disk is slow, so the result is cached in a file. Cache is valid while
+modification times of program directories are the same, so installing or removing a build invalidates it.
+Vector instructions of a program variant are checked against flags of queue's nodes, not of the host
+that submits jobs (see environment_desc.py).
+"""
+
+import os
+import json
+from .file_utils import CACHE_DIR, write_json_file
+
+PROBE_CACHE = os.path.join(CACHE_DIR, 'environment.json')
+
+
+def _mtime(directory):
+    try:
+        return os.path.getmtime(directory)
+    except OSError:
+        return None
+
+
+def installed_programs(programs):
+    # programs: list of (directory, executable). Returns list of executables that exist.
+    return sorted(set(exe for d, exe in programs if os.access(os.path.join(d, exe), os.X_OK)))
+
+
+def probe(programs):
+    # Returns dict with installed (executables) key
+    return dict(installed=installed_programs(programs))
+
+
+def cached_probe(programs, cache_file=PROBE_CACHE):
+    # probe() result, cached while program directories don't change
+    mtimes = dict((d, _mtime(d)) for d in sorted(set(d for d, _ in programs)))
+    try:
+        with open(cache_file, 'r') as _in:
+            cache = json.load(_in)
+    except (OSError, ValueError):
+        cache = dict()
+    if cache.get('mtimes') == mtimes and cache.get('programs') == sorted(exe for _, exe in programs) and \
+            'probe' in cache:
+        return cache['probe']
+
+    result = probe(programs)
+    write_json_file(cache_file, dict(mtimes=mtimes, programs=sorted(exe for _, exe in programs), probe=result),
+                    indent=1)
+    return result
@@ -1,33 +1,69 @@
 import os
+import math
 from datetime import datetime
+from collections import namedtuple
 from .environment_desc import IsabellaException, lasted_seconds, get_program_desc
+from .journal import JOURNAL_FILENAME, JOB_FILENAME, Journal, AtomicOpen, open_journal, find_journal, \
+    read_status_file
 
-PROCESSING_FILENAME = 'obrada.status'
-JOB_FILENAME = 'posao.status'
 PROCESSING_OUTPUT_FILENAME = 'obrada_output.zip'
+# Number of jobs, then lines 'finished <job directory>' and 'post_run <job directory>'.
+# Finishing job reads only this small file, not the journal.
+FINISHED_FILENAME = 'obrada.finished'
+
+# Multi slot jobs that used less than this fraction of their slots' CPU time are reported
+OVERPROVISIONED_EFFICIENCY = 0.5
 
 _datetime_fromiso = datetime.fromisoformat if hasattr(datetime, 'fromisoformat') else \
     (lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S.%f'))
 
 
-def write_processing_status(jobs, email):
-    with open(PROCESSING_FILENAME, 'w') as _out:
-        for i, d in enumerate(jobs):
-            _out.write(f'job_dir_{i}: {d}\n')
-        if email:
-            _out.write(f'email: {email}\n')
+def write_processing_status(jobs, email, collect_job=False, dependencies=None):
+    # Creates processing journal (see journal.py) in current directory.
+    # dependencies: for each job, list of indices of jobs it depends on
+    data = dict((f'job_dir_{i}', d) for i, d in enumerate(jobs))
+    for i, deps in enumerate(dependencies or []):
+        if deps:
+            data[f'job_depends_{i}'] = ','.join(map(str, deps))
+    if email:
+        data['email'] = email
+    if collect_job:
+        data['collect_job'] = 1
+    Journal('.').create(data)
+    with open(FINISHED_FILENAME, 'w') as _out:
+        _out.write(f'{len(jobs)}\n')
+
+
+def _parse_finished(lines):
+    # Returns (number of jobs, set of finished job directories, job directory that took post-processing or None)
+    finished, post_run = set(), None
+    for line in lines[1:]:
+        key, _, j_dir = line.partition(' ')
+        if key == 'finished':
+            finished.add(j_dir)
+        elif key == 'post_run':
+            post_run = j_dir
+    return int(lines[0]), finished, post_run
+
+
+def append_processing_status(data, directory=None):
+    # Appends values to processing journal. Jobs can already be running, so journal is locked.
+    open_journal(directory or '.').append(data)
 
 
 def check_is_directory_processing():
-    if os.path.isfile(PROCESSING_FILENAME):
+    if open_journal('.'):
         raise IsabellaException('Directory is already in processing!')
 
 
 def read_job_data(cwd=None):
-    p_file = os.path.join(cwd, JOB_FILENAME) if cwd else JOB_FILENAME
-    if os.path.isfile(p_file):
-        with open(p_file, 'r') as _in:
-            return dict(tuple(x.strip() for x in l.split(':', 1)) for l in _in)
+    # Data of job in directory (default current), None if job didn't start
+    j_dir = os.path.abspath(cwd or '.')
+    journal = find_journal(j_dir)
+    if journal is None or journal.legacy:
+        return read_status_file(os.path.join(j_dir, JOB_FILENAME))
+    journal.reload()
+    return journal.job_data(j_dir)
 
 
 def lasted_str(started, ended):
@@ -56,89 +92,242 @@ def lasted_str(started, ended):
     return ':'.join(parts[:2])
 
 
+def memory_str(kb):
+    return f'{kb / 1024 ** 2:.1f}GB' if kb >= 1024 ** 2 else f'{kb / 1024:.0f}MB'
+
+
+def print_resource_summary(jobs):
+    # Summary of measured resource usage (see monitor.py) of finished jobs, given as (job directory, job data)
+    measured = []
+    for j_dir, job_data in jobs:
+        if job_data and job_data.get('ended') and job_data.get('cpu_efficiency'):
+            measured.append((j_dir, int(job_data.get('NSLOTS') or 1), float(job_data['cpu_efficiency']),
+                             int(job_data.get('max_rss_kb') or 0)))
+    if not measured:
+        return
+    slots = sum(m[1] for m in measured)
+    used = sum(m[1] * m[2] for m in measured)
+    print(f"\nMeasured jobs: {len(measured)}, CPU efficiency: {100 * used / slots:.0f}% of {slots} slots, "
+          f"max memory: {memory_str(max(m[3] for m in measured))}")
+    over = [m for m in measured if m[1] > 1 and m[2] < OVERPROVISIONED_EFFICIENCY]
+    if over:
+        print(f"Over-provisioned jobs (CPU efficiency below {100 * OVERPROVISIONED_EFFICIENCY:.0f}%):")
+        for j_dir, nslots, efficiency, _ in over:
+            print(f"  {j_dir}: {nslots} slots at {100 * efficiency:.0f}%, "
+                  f"would fit in {max(1, math.ceil(nslots * efficiency))} slots")
+
+
+# state: waiting, running, finished or failed. eta: seconds until running job finishes, None if not known
+_JobStatus = namedtuple('_JobStatus', 'state, text, eta')
+
+
+def job_status(job_data, sge_state=None, vanished=False, progress=('', None), now=None):
+    # Status of a job, shown by status, watch and summary of processings.
+    # progress: (description, fraction of work done or None) of running job
+    if not job_data:
+        failed = sge_state == 'error' or vanished
+        text = 'Not started yet' + (f' - {sge_state}' if sge_state else '') + \
+            (' - vanished from SGE' if vanished else '')
+        return _JobStatus('failed' if failed else 'waiting', text, None)
+
+    now = now or datetime.now()
+    ended = job_data.get('ended')
+    lasted = lasted_str(job_data['started'], ended or str(now))
+    if ended:
+        exit_code = str(job_data.get('exit_code') or 0)
+        if exit_code != '0':
+            return _JobStatus('failed', f'{lasted} - finished with exit code {exit_code}', 0)
+        return _JobStatus('finished', f'{lasted} - finished', 0)
+
+    desc, fraction = progress
+    parts = [desc] if desc else []
+    if job_data.get('segment'):
+        # Resubmitted job, resumed from checkpoint
+        parts.insert(0, f"segment {job_data['segment']}")
+    eta = None
+    if fraction:
+        elapsed = (now - _datetime_fromiso(job_data['started'])).total_seconds()
+        eta = elapsed * (1 - fraction) / fraction
+        parts.append(f"{100 * fraction:.1f}%, ETA {lasted_seconds(int(eta))}")
+    if vanished:
+        parts.append('vanished from SGE')
+    elif sge_state and sge_state != 'running':
+        parts.append(sge_state)
+    state = 'failed' if vanished or sge_state == 'error' else 'running'
+    return _JobStatus(state, f"{lasted} - {', '.join(parts)}" if parts else lasted, eta)
+
+
 class Processing:
-    def __init__(self):
-        self.directory = None
-        self.data = None
-        self._find_directory()
-
-    def _find_directory(self):
-        # This is called from processing or job directory.
-        # Check current directory and up ones
-        _dir = os.path.abspath('.')
-        while True:
-            o_file = os.path.join(_dir, PROCESSING_FILENAME)
-            if os.path.isfile(o_file):
-                with open(o_file, 'r') as _in:
-                    self.directory = _dir
-                    self.data = dict(tuple(x.strip() for x in line.split(':', 1)) for line in _in if line)
-                    return
-            #
-            n_dir = os.path.abspath(os.path.join(_dir, '..'))
-            if _dir == n_dir:
-                return
-            _dir = n_dir
+    # Processing is found from processing or job directory, checking directory and up ones.
+    # Processing and jobs' data are read from processing journal, in one read.
+    # If read is not set, journal is read on reload().
+    def __init__(self, directory='.', read=True):
+        self.journal = find_journal(directory)
+        self.directory = self.journal.directory if self.journal else None
+        if self.journal and read:
+            self.journal.reload()
+
+    @property
+    def data(self):
+        return self.journal.processing if self.journal else None
+
+    def reload(self):
+        # Returns set of changed jobs, None in the set marks change of processing data
+        return self.journal.reload()
 
     def job_directories(self):
         return (v for k, v in self.data.items() if k.startswith('job_dir_'))
 
+    def job_data(self, job_directory):
+        return self.journal.job_data(job_directory)
+
     def job_directories_with_data(self):
-        return ((v, read_job_data(os.path.join(self.directory, v)))
-                for k, v in self.data.items() if k.startswith('job_dir_'))
+        return ((v, self.journal.job_data(v)) for k, v in self.data.items() if k.startswith('job_dir_'))
+
+    def job_ids(self):
+        # Returns dict job directory -> SGE job ID (<job_id> or <job_id>.<task_id>) for submitted jobs
+        return dict((v, self.data[f'job_id_{k[8:]}']) for k, v in self.data.items()
+                    if k.startswith('job_dir_') and f'job_id_{k[8:]}' in self.data)
 
     def is_processing(self):
         return self.directory is not None
 
+    def job_index(self, job_directory):
+        # Returns index of job with given (absolute or relative to processing) directory
+        j_dir = os.path.normpath(os.path.relpath(os.path.abspath(job_directory), self.directory))
+        for k, v in self.data.items():
+            if k.startswith('job_dir_') and os.path.normpath(v) == j_dir:
+                return int(k[8:])
+
+    def _finished_file(self):
+        return os.path.join(self.directory, FINISHED_FILENAME)
+
     def is_finished(self):
         if not self.is_processing():
             return False
 
-        for j_dir in self.job_directories():
-            o_file = os.path.join(self.directory, j_dir, JOB_FILENAME)
-            if os.path.isfile(o_file):
-                with open(o_file, 'r') as _in:
-                    if not any(line.startswith('ended:') for line in _in):
-                        return False
+        # Jobs that marked their finish (mark_job_finished()) are not checked
+        finished = set()
+        if os.path.isfile(self._finished_file()):
+            with open(self._finished_file(), 'r') as _in:
+                finished = _parse_finished(_in.read().splitlines())[1]
+        for k, j_dir in self.data.items():
+            if not k.startswith('job_dir_') or f'job_finished_{k[8:]}' in self.data or \
+                    self.journal.job_key(j_dir) in finished:
+                continue
+            job_data = self.job_data(j_dir)
+            if job_data is not None and 'ended' not in job_data:
+                return False
         return True
 
-    def print_status(self):
-        now = str(datetime.now())
+    def mark_job_finished(self, job_directory='.'):
+        # Marks job as finished in finished jobs file.
+        # Returns True if all jobs are finished and post-processing was not already taken by other job.
+        # File is read under the lock, so exactly one of concurrently finishing jobs takes post-processing.
+        # Journal is read only by the job that takes post-processing.
+        if not self.is_processing():
+            return False
+        if not os.path.isfile(self._finished_file()):
+            return self._mark_job_finished_in_journal(job_directory)
+        j_dir = self.journal.job_key(os.path.abspath(job_directory))
+        try:
+            with AtomicOpen(self._finished_file(), 'r+') as _f:
+                num_jobs, finished, post_run = _parse_finished(_f.read().splitlines())
+                lines = [] if j_dir in finished else [f'finished {j_dir}']
+                finished.add(j_dir)
+                result = len(finished) >= num_jobs and post_run is None
+                if result:
+                    lines.append(f'post_run {j_dir}')
+                _f.write(''.join(f'{line}\n' for line in lines))
+        except (OSError, ValueError):
+            print(f"Error: locking of file {self._finished_file()}!")
+            return False
+        if result:
+            self.journal.append(dict(post_run=j_dir))
+            self.journal.reload()
+        return result
+
+    def _mark_job_finished_in_journal(self, job_directory):
+        # Processings created without finished jobs file mark finish in journal
+        self.journal.reload()
+        idx = self.job_index(job_directory)
+
+        def _mark(journal):
+            data = journal.processing
+            new = dict()
+            if idx is not None and f'job_finished_{idx}' not in data:
+                new[f'job_finished_{idx}'] = str(datetime.now())
+            num_jobs = sum(1 for k in data if k.startswith('job_dir_'))
+            num_finished = sum(1 for k in set(data) | set(new) if k.startswith('job_finished_'))
+            if num_finished < num_jobs or 'post_run' in data:
+                return new, False
+            new['post_run'] = os.path.relpath(os.path.abspath(job_directory), self.directory)
+            return new, True
+
+        try:
+            result = self.journal.update(_mark)
+        except Exception:
+            print(f"Error: locking of file {self.journal.filename}!")
+            return False
+        self.journal.reload()
+        return result
+
+    def status_file_mtime(self):
+        # Time of the last change of processing data (submitted jobs, finish marks)
+        return self.journal.processing_time
+
+    def job_statuses(self, sge_states=None, progress=None):
+        # Yields (job directory, job data, _JobStatus) of all jobs.
+        # sge_states: SGE job states (sge.qstat()) used to show queued, errored and vanished jobs
+        # progress: method (job directory, job data) -> (description, fraction) of running job,
+        #           default reads program's log file
+        from .sge import job_state
+        now = datetime.now()
+        job_ids = self.job_ids()
         for j_dir, job_data in self.job_directories_with_data():
-            if not job_data:
-                print(f"{j_dir}: Not started yet")
-                continue
-            # Vrijeme
-            ended = job_data.get('ended')
-            lasted = lasted_str(job_data['started'], ended or now)
-
-            # Program specific
-            prog_spec = 'finished'
-            if not ended:
-                program_desc = get_program_desc(job_data['program_type'])
-                if program_desc:
-                    prog_spec = program_desc.status_string(j_dir)
-            if prog_spec:
-                print(f"{j_dir}: {lasted} - {prog_spec}")
-            else:
-                print(f"{j_dir}: {lasted}")
-
-    def collect_output(self):
-        from zipfile import ZipFile, ZIP_DEFLATED
+            sge_state = job_state(sge_states, job_ids.get(j_dir))
+            vanished = sge_states is not None and j_dir in job_ids and not sge_state
+            prog = ('', None)
+            if job_data and not job_data.get('ended'):
+                if progress:
+                    prog = progress(j_dir, job_data)
+                else:
+                    program_desc = get_program_desc(job_data.get('program_type'))
+                    if program_desc:
+                        prog = program_desc.read_progress(os.path.join(self.directory, j_dir), job_data)
+            yield j_dir, job_data, job_status(job_data, sge_state=sge_state, vanished=vanished, progress=prog, now=now)
+
+    def print_status(self, sge_states=None, progress=None):
+        for j_dir, _, status in self.job_statuses(sge_states=sge_states, progress=progress):
+            print(f"{j_dir}: {status.text}")
+        print_resource_summary(self.job_directories_with_data())
+
+    def collect_output(self, workers=None):
+        # Collects files into output zip. Only new or changed files are compressed, in parallel.
+        from .collect import collect_files
         prev_cwd = os.getcwd()
         os.chdir(self.directory)
         files_to_zip = []
         for j_dir, job_data in self.job_directories_with_data():
+            if not job_data:
+                continue
             program_desc = get_program_desc(job_data['program_type'])
             if program_desc:
                 fz = program_desc.files_to_zip(job_data)
+                if fz is None:
+                    # Part of a split job, output is in gather job's directory
+                    continue
                 if fz:
                     files_to_zip.extend(os.path.join(j_dir, f) for f in fz)
-            files_to_zip.append(os.path.join(j_dir, JOB_FILENAME))
+            if self.journal.legacy:
+                files_to_zip.append(os.path.join(j_dir, JOB_FILENAME))
+        if not self.journal.legacy:
+            files_to_zip.append(JOURNAL_FILENAME)
         #
-        with ZipFile(PROCESSING_OUTPUT_FILENAME, 'w', compression=ZIP_DEFLATED) as output:
-            for f_name in files_to_zip:
-                output.write(f_name)
-        os.chdir(prev_cwd)
+        try:
+            collect_files(PROCESSING_OUTPUT_FILENAME, files_to_zip, workers=workers)
+        finally:
+            os.chdir(prev_cwd)
 
     # Meils
     def send_pre_email(self):
@@ -149,19 +338,16 @@ class Processing:
         email = self.data.get('email')
         if not email:
             return
-        if any(os.path.isfile(os.path.join(self.directory, v, JOB_FILENAME))
-               for k, v in self.data.items() if k.startswith('job_dir_')):
+        if any(self.job_data(v) is not None for k, v in self.data.items() if k.startswith('job_dir_')):
             return
 
         #
         try:
-            with AtomicOpen(os.path.join(self.directory, PROCESSING_FILENAME), 'r+') as _out:
-                for l in _out:
-                    if l.startswith('mail_send'):
-                        return
-                _out.write('mail_send: 1\n')
+            if not self.journal.update(lambda j: (None, False) if 'mail_send' in j.processing else
+                                       (dict(mail_send=1), True)):
+                return
         except Exception:
-            print(f"Error: locking of file {os.path.join(self.directory, PROCESSING_FILENAME)}!")
+            print(f"Error: locking of file {self.journal.filename}!")
             return
 
         send_email(email, 'Isabella obrada', f'Počeo je prvi posao obrada u direktoriju {self.directory}.')
@@ -186,61 +372,3 @@ def send_email(to_email, subject, text, server='localhost'):
     s = smtplib.SMTP(server)
     s.send_message(msg)
     s.quit()
-
-
-# Lock file
-# https://stackoverflow.com/questions/489861/locking-a-file-in-python
-try:
-    # Posix based file locking (Linux, Ubuntu, MacOS, etc.)
-    #   Only allows locking on writable files, might cause
-    #   strange results for reading.
-    import fcntl
-
-    def lock_file(f):
-        if f.writable():
-            fcntl.lockf(f, fcntl.LOCK_EX)
-
-    def unlock_file(f):
-        if f.writable():
-            fcntl.lockf(f, fcntl.LOCK_UN)
-except ModuleNotFoundError:
-    # Windows file locking
-    import msvcrt
-
-    def file_size(f):
-        return os.path.getsize(os.path.realpath(f.name))
-
-    def lock_file(f):
-        msvcrt.locking(f.fileno(), msvcrt.LK_RLCK, file_size(f))
-
-    def unlock_file(f):
-        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, file_size(f))
-
-
-# Class for ensuring that all file operations are atomic, treat
-# initialization like a standard call to 'open' that happens to be atomic.
-# This file opener *must* be used in a "with" block.
-class AtomicOpen:
-    # Open the file with arguments provided by user. Then acquire
-    # a lock on that file object (WARNING: Advisory locking).
-    def __init__(self, path, *args, **kwargs):
-        # Open the file and acquire a lock on the file before operating
-        self.file = open(path, *args, **kwargs)
-        # Lock the opened file
-        lock_file(self.file)
-
-    # Return the opened file object (knowing a lock has been obtained).
-    def __enter__(self, *args, **kwargs):
-        return self.file
-
-    # Unlock the file and close the file object.
-    def __exit__(self, exc_type=None, exc_value=None, traceback=None):
-        # Flush to make sure all buffered contents are written to file.
-        self.file.flush()
-        os.fsync(self.file.fileno())
-        # Release the lock on the file.
-        unlock_file(self.file)
-        self.file.close()
-        # Handle exceptions that may have come up during execution, by
-        # default any exceptions are raised to the user.
-        return exc_type is None
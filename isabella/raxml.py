@@ -1,6 +1,7 @@
 import re
+import shlex
 import os.path
-from collections import deque
+from .file_utils import head_lines
 from .environment_desc import ProgramDescription, lasted_seconds
 
 # Regex for these lines
@@ -8,11 +9,92 @@ from .environment_desc import ProgramDescription, lasted_seconds
 # Overall Time for 1000 Rapid Bootstraps 119924.468086 seconds
 # Fast ML search Time: 56163.194389 seconds
 # Slow ML search Time: 7035.182726 seconds
+# Command line, in the info file header:
+# raxmlHPC-PTHREADS-AVX2 -T 28 -f a -x 12345 -p 12345 -N 1000 -m GTRGAMMA -s alignment.phy -n raxml_output
+_command_line = re.compile(r'^raxmlHPC\S*\s.*\s-[N#]\s*(\d+)')
+# Header lines used for input features
+# Alignment has 2345 distinct alignment patterns
+_patterns = re.compile(r'^Alignment has (\d+) distinct alignment patterns')
+_alignment_file = re.compile(r'^raxmlHPC\S*\s.*\s-s\s*(\S+)')
+_alignment_arg = re.compile(r'(?:^|\s)-s\s*(\S+)')
+_model_arg = re.compile(r'(?:^|\s)-m\s*(\S+)')
 _bootstrap_iteration = re.compile(r'^Bootstrap\[(\d+)\]')
 _overall_time = re.compile(r'Rapid Bootstraps (\d+)')  # Take only seconds
 _fast_ml = re.compile(r'^Fast ML search Time: (\d+)')  # Take only seconds
 _slow_ml = re.compile(r'^Slow ML search Time: (\d+)')  # Take only seconds
 
+# Options that are set by split jobs
+_SPLIT_OPTIONS = ('-T', '-f', '-x', '-p', '-N', '-#', '-n', '-s', '-b')
+
+
+def _phylip_dimensions(filename):
+    # Phylip header: <number of taxa> <alignment length>
+    header = head_lines(filename, 1)
+    parts = header[0].split() if header else []
+    if len(parts) == 2 and all(p.isdigit() for p in parts):
+        return dict(taxa=int(parts[0]), alignment_length=int(parts[1]))
+    return dict()
+
+
+def _parse_args(cmd):
+    # Returns dict option -> value of options with value used for splitting, and list of other arguments
+    options, rest = dict(), []
+    tokens = shlex.split(cmd)
+    while tokens:
+        t = tokens.pop(0)
+        flag = t[:2]
+        if flag in _SPLIT_OPTIONS:
+            options[flag] = t[2:] or (tokens.pop(0) if tokens else '')
+        else:
+            rest.append(t)
+    return options, rest
+
+
+def _split_bootstraps(cwd, job_desc, num_parts):
+    # Rapid bootstrap with ML search (-f a -x <seed> -N <num>) is split into num_parts bootstrap only jobs,
+    # with distinct seeds. Gather job concatenates bootstraps, runs ML search and draws bipartitions
+    # on the best tree, and renames output files to the names of a single run.
+    options, rest = _parse_args(job_desc.get('single') or job_desc.get('threads') or '')
+    num_bootstraps = options.get('-N') or options.get('-#')
+    if options.get('-f') != 'a' or not options.get('-x') or not (num_bootstraps or '').isdigit() or \
+            not options.get('-s'):
+        return
+    num_bootstraps = int(num_bootstraps)
+    num_parts = min(num_parts, num_bootstraps)
+    seed = int(options['-x'])
+    ml_seed = options.get('-p', seed)
+    name = options.get('-n', 'raxml_output')
+    alignment = os.path.abspath(os.path.join(cwd, options['-s']))
+    rest = ' '.join(shlex.quote(a) for a in rest)
+    runtime_hours = job_desc.get('runtime_hours')
+
+    parts = []
+    for i in range(num_parts):
+        num = num_bootstraps // num_parts + (i < num_bootstraps % num_parts)
+        args = f'-x {seed + 1000 * i} -p {seed + 1000 * i} -N {num} {rest} -s {alignment} -n {name}'
+        part_desc = dict(job_desc, single=args, threads='-T {num_threads} ' + args)
+        if runtime_hours:
+            part_desc['runtime_hours'] = float(runtime_hours) * num / num_bootstraps
+        parts.append((os.path.join(cwd, f'bs_{i + 1}'), part_desc, dict(bootstrap_part=i + 1)))
+
+    def _gather(threads):
+        t = '-T {num_threads} ' if threads else ''
+        part_files = ' '.join(f'bs_{i + 1}/RAxML_{{f}}.{name}' for i in range(num_parts))
+        script = f"""cat {part_files.format(f='bootstrap')} > RAxML_bootstrap.{name}
+{{exe}} {t}-p {ml_seed} {rest} -s {alignment} -n {name}_ml
+{{exe}} {t}-f b -t RAxML_bestTree.{name}_ml -z RAxML_bootstrap.{name} {rest} -n {name}_bp
+mv RAxML_bestTree.{name}_ml RAxML_bestTree.{name}
+mv RAxML_bipartitions.{name}_bp RAxML_bipartitions.{name}
+mv RAxML_bipartitionsBranchLabels.{name}_bp RAxML_bipartitionsBranchLabels.{name}
+cat {part_files.format(f='info')} RAxML_info.{name}_ml RAxML_info.{name}_bp > RAxML_info.{name}
+rm -f RAxML_*.{name}_ml RAxML_*.{name}_bp"""
+        # One command, so that it can be measured and staged as a program run
+        return 'bash -e -c ' + shlex.quote(script)
+
+    gather_desc = dict((k, v) for k, v in job_desc.items() if k != 'runtime_hours')
+    gather_desc.update(single=_gather(False), threads=_gather(True))
+    return parts, (gather_desc, dict(bootstrap_parts=num_parts))
+
 
 class RAxML(ProgramDescription):
     @staticmethod
@@ -22,38 +104,81 @@ class RAxML(ProgramDescription):
 
     @staticmethod
     def files_to_zip(job_data):
+        if job_data.get('bootstrap_part'):
+            return None
         return ('RAxML_bestTree.raxml_output', 'RAxML_bipartitionsBranchLabels.raxml_output',
-                'RAxML_bipartitions.raxml_output', 'RAxML_bootstrap.raxml_output', 'RAxML_info.raxml_output'),
-
-    @staticmethod
-    def status_string(job_directory):
-        num_iterations = 1000  # ToDo: find data somewhere
-
-        r_o = os.path.join(job_directory, 'RAxML_info.raxml_output')
-        if os.path.isfile(r_o):
-            with open(r_o, 'r') as _in:
-                last_lines = deque(_in, 10)
-            # Check lines from the end
-            f_ml = None
-            lines = reversed(last_lines)
-            for line in lines:
-                m = _bootstrap_iteration.search(line)
-                if m:
-                    num_iter = m.group(1)
-                    return f"on iteration {num_iter}/{num_iterations}"
-
-                m = _overall_time.search(line)
-                if m:
-                    seconds = lasted_seconds(int(m.group(1)))
-                    if f_ml:
-                        return f"bootstrap {seconds}, {f_ml}"
-                    return f"bootstrap {seconds}"
-
-                m = _fast_ml.search(line)
-                if m:
-                    f_ml = f"Fast ML {lasted_seconds(int(m.group(1)))}"
-
-                m = _slow_ml.search(line)
-                if m:
-                    return f"Slow ML {lasted_seconds(int(m.group(1)))}"
-        return ''
+                'RAxML_bipartitions.raxml_output', 'RAxML_bootstrap.raxml_output', 'RAxML_info.raxml_output')
+
+    @staticmethod
+    def split_job(cwd, job_desc, num_parts):
+        return _split_bootstraps(cwd, job_desc, num_parts)
+
+    # resume_job() is not implemented. RAxML checkpoints (-R) restart only ML search, not rapid bootstraps.
+
+    @staticmethod
+    def suggest_num_threads(features, low, high):
+        # RAxML manual: one thread per ~500 DNA site patterns. Alignment length is upper bound on patterns.
+        if features and features.get('alignment_length'):
+            return max(low, min(high, features['alignment_length'] // 500))
+
+    @staticmethod
+    def input_features(job_directory, job_data):
+        features = dict()
+        for line in head_lines(os.path.join(job_directory, 'RAxML_info.raxml_output'), 100):
+            m = _patterns.search(line)
+            if m:
+                features['patterns'] = int(m.group(1))
+            m = _alignment_file.search(line)
+            if m:
+                features.update(_phylip_dimensions(os.path.join(job_directory, m.group(1))))
+        return features
+
+    @staticmethod
+    def job_input_features(cwd, job_desc):
+        m = _alignment_arg.search(job_desc.get('threads') or job_desc.get('single') or '')
+        if m:
+            return _phylip_dimensions(os.path.join(cwd, m.group(1)))
+
+    @staticmethod
+    def estimate_memory_gb(cwd, job_desc):
+        # RAxML manual: (n - 2) * m * (16 * 8) bytes for DNA data under GAMMA model, n taxa, m distinct patterns.
+        # CAT model uses 1 rate instead of 4, protein data 20 states instead of 4.
+        # Alignment length is used as upper bound on number of patterns.
+        features = RAxML.job_input_features(cwd, job_desc)
+        if not features:
+            return
+        m = _model_arg.search(job_desc.get('threads') or job_desc.get('single') or '')
+        model = m.group(1) if m else ''
+        states = 20 if 'PROT' in model else 4
+        rates = 4 if 'GAMMA' in model else 1
+        return max(features['taxa'] - 2, 1) * features['alignment_length'] * states * rates * 8 / 1024 ** 3
+
+    @staticmethod
+    def progress_file(job_data):
+        return 'RAxML_info.raxml_output'
+
+    @staticmethod
+    def progress_patterns():
+        return (('bootstrap', _bootstrap_iteration), ('num_bootstraps', _command_line),
+                ('bootstrap_time', _overall_time), ('fast_ml', _fast_ml), ('slow_ml', _slow_ml))
+
+    @staticmethod
+    def status_lines():
+        # Command line is in the header
+        return 100, 10
+
+    @staticmethod
+    def progress(state):
+        if 'slow_ml' in state:
+            return f"Slow ML {lasted_seconds(state['slow_ml'])}", None
+        if 'bootstrap_time' in state:
+            desc = f"bootstrap {lasted_seconds(state['bootstrap_time'])}"
+            if 'fast_ml' in state:
+                desc += f", Fast ML {lasted_seconds(state['fast_ml'])}"
+            return desc, None
+        if 'bootstrap' in state:
+            num_bootstraps = state.get('num_bootstraps')
+            if num_bootstraps:
+                return f"on iteration {state['bootstrap']}/{num_bootstraps}", (state['bootstrap'] + 1) / num_bootstraps
+            return f"on iteration {state['bootstrap']}", None
+        return '', None
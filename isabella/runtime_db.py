@@ -0,0 +1,189 @@
+"""
+Database of job runtimes, harvested from journals (and legacy posao.status files) of past processings.
+
+Indexing is incremental. Finished processings (with post_run mark) which journal didn't change are skipped,
+and legacy job records are re-read only if posao.status changed (size, mtime).
+"""
+
+import os
+import sqlite3
+from .environment_desc import get_program_desc, IsabellaException
+from .processing import JOB_FILENAME, _datetime_fromiso
+from .journal import open_journal, read_status_file
+from .file_utils import CACHE_DIR
+
+RUNTIME_DB = os.path.join(CACHE_DIR, 'runtimes.sqlite')
+
+# Job record columns (besides path, mtime and size)
+JOB_COLUMNS = ('program_type', 'started', 'ended', 'seconds', 'nslots', 'queue', 'hostname', 'job_id',
+               'taxa', 'alignment_length', 'patterns', 'cpu_seconds', 'max_rss_kb')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    path TEXT PRIMARY KEY, mtime REAL, size INTEGER,
+    program_type TEXT, started TEXT, ended TEXT, seconds REAL, nslots INTEGER, queue TEXT, hostname TEXT,
+    job_id TEXT, taxa INTEGER, alignment_length INTEGER, patterns INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_program ON jobs (program_type, nslots);
+CREATE TABLE IF NOT EXISTS processings (path TEXT PRIMARY KEY, mtime REAL, finished INTEGER);
+"""
+# Columns added to jobs table after first version
+_ADDED_COLUMNS = (('cpu_seconds', 'REAL'), ('max_rss_kb', 'INTEGER'))
+
+
+def _int_or_none(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float_or_none(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def job_record(job_directory, job_data):
+    # Returns values of JOB_COLUMNS for job's data
+    started, ended = job_data.get('started'), job_data.get('ended')
+    seconds = None
+    if started and ended:
+        try:
+            seconds = (_datetime_fromiso(ended) - _datetime_fromiso(started)).total_seconds()
+        except ValueError:
+            pass
+    features = dict()
+    program_desc = get_program_desc(job_data.get('program_type'))
+    if program_desc and ended:
+        features = program_desc.input_features(job_directory, job_data) or dict()
+    cpu = [_float_or_none(job_data.get(k)) for k in ('cpu_user', 'cpu_sys')]
+    return (job_data.get('program_type'), started, ended, seconds, _int_or_none(job_data.get('NSLOTS')) or 1,
+            job_data.get('QUEUE') or None, job_data.get('HOSTNAME') or None, job_data.get('JOB_ID') or None,
+            features.get('taxa'), features.get('alignment_length'), features.get('patterns'),
+            sum(cpu) if None not in cpu else None, _int_or_none(job_data.get('max_rss_kb')))
+
+
+def percentile(sorted_values, p):
+    # Nearest rank percentile of sorted list
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+class RuntimeDB:
+    def __init__(self, filename=RUNTIME_DB):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.conn = sqlite3.connect(filename)
+        self.conn.executescript(_SCHEMA)
+        columns = set(r[1] for r in self.conn.execute('PRAGMA table_info(jobs)'))
+        for column, column_type in _ADDED_COLUMNS:
+            if column not in columns:
+                self.conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+
+    def close(self):
+        self.conn.close()
+
+    # Indexing
+    def index(self, roots):
+        # Scans directory trees for processings and job directories. Returns number of (re)indexed jobs.
+        known_jobs = dict((p, (m, s)) for p, m, s in self.conn.execute('SELECT path, mtime, size FROM jobs'))
+        known_processings = dict((p, (m, f)) for p, m, f in self.conn.execute(
+            'SELECT path, mtime, finished FROM processings'))
+        jobs, processings = [], []
+
+        def _check_job(j_dir):
+            j_file = os.path.join(j_dir, JOB_FILENAME)
+            try:
+                st = os.stat(j_file)
+            except OSError:
+                return
+            if known_jobs.get(j_dir) == (st.st_mtime, st.st_size):
+                return
+            jobs.append((j_dir, st.st_mtime, st.st_size) + job_record(j_dir, read_status_file(j_file) or dict()))
+
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(os.path.abspath(root)):
+                journal = open_journal(dirpath)
+                if journal:
+                    # Job directories are listed in processing journal, no need to walk below
+                    dirnames[:] = []
+                    mtime = os.path.getmtime(journal.filename)
+                    known = known_processings.get(dirpath)
+                    if known and known[0] == mtime and known[1]:
+                        continue
+                    journal.reload()
+                    for k, v in journal.processing.items():
+                        if not k.startswith('job_dir_'):
+                            continue
+                        j_dir = os.path.normpath(os.path.join(dirpath, v))
+                        if journal.legacy:
+                            _check_job(j_dir)
+                        elif journal.job_data(v):
+                            # Journal's data of all jobs is already read
+                            jobs.append((j_dir, mtime, None) + job_record(j_dir, journal.job_data(v)))
+                    processings.append((dirpath, mtime, int('post_run' in journal.processing)))
+                elif JOB_FILENAME in filenames:
+                    _check_job(dirpath)
+
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO jobs VALUES ({', '.join('?' * (3 + len(JOB_COLUMNS)))})",
+                                  jobs)
+            self.conn.executemany('INSERT OR REPLACE INTO processings VALUES (?, ?, ?)', processings)
+        return len(jobs)
+
+    # Queries
+    def runtimes(self, program_type=None, nslots=None, queue=None, **features):
+        # Returns list of (seconds, nslots, taxa, alignment_length, patterns) of finished jobs.
+        # Features (taxa=, patterns=, ...) are matched exactly.
+        where, params = ['seconds IS NOT NULL'], []
+        for column, value in dict(features, program_type=program_type, nslots=nslots, queue=queue).items():
+            if value is not None:
+                where.append(f'{column} = ?')
+                params.append(value)
+        return self.conn.execute(f"SELECT seconds, nslots, taxa, alignment_length, patterns FROM jobs "
+                                 f"WHERE {' AND '.join(where)}", params).fetchall()
+
+    def distribution(self, group_by=('program_type', 'nslots', 'queue'), program_type=None):
+        # Returns list of (group values, count, min, median, p90, max) of runtimes in seconds
+        unknown = [c for c in group_by if c not in JOB_COLUMNS]
+        if unknown:
+            raise IsabellaException(f"Unknown job columns: {', '.join(unknown)}")
+        where, params = 'seconds IS NOT NULL', []
+        if program_type:
+            where += ' AND program_type = ?'
+            params.append(program_type)
+        groups = dict()
+        for row in self.conn.execute(f"SELECT {', '.join(group_by)}, seconds FROM jobs WHERE {where}", params):
+            groups.setdefault(row[:-1], []).append(row[-1])
+        result = []
+        for key in sorted(groups, key=lambda k: tuple((v is None, v) for v in k)):
+            values = sorted(groups[key])
+            result.append((key, len(values), values[0], percentile(values, 0.5), percentile(values, 0.9), values[-1]))
+        return result
+
+    def estimate(self, program_type, nslots, taxa=None, alignment_length=None):
+        # Estimated runtime (seconds) of a job, as 90th percentile of past runs with the same number of slots.
+        # If input size is known, runtimes are scaled by taxa * alignment length.
+        rows = self.runtimes(program_type=program_type, nslots=nslots)
+        if not rows:
+            return None
+        if taxa and alignment_length:
+            per_site = sorted(s / (t * a) for s, _, t, a, _ in rows if t and a)
+            if per_site:
+                return percentile(per_site, 0.9) * taxa * alignment_length
+        return percentile(sorted(r[0] for r in rows), 0.9)
+
+    def scaling_curve(self, program_type, alignment_length=None):
+        # Returns dict nslots -> median runtime of past runs. If alignment length is known, only runs on
+        # similar inputs (alignment length within factor of 2) are used, and runtimes are per taxa * site.
+        where, params = 'seconds IS NOT NULL AND program_type = ?', [program_type]
+        if alignment_length:
+            where += ' AND taxa IS NOT NULL AND alignment_length BETWEEN ? AND ?'
+            params.extend((alignment_length / 2, alignment_length * 2))
+        groups = dict()
+        for seconds, nslots, taxa, length in self.conn.execute(
+                f'SELECT seconds, nslots, taxa, alignment_length FROM jobs WHERE {where}', params):
+            groups.setdefault(nslots, []).append(seconds / (taxa * length) if alignment_length else seconds)
+        return dict((n, percentile(sorted(v), 0.5)) for n, v in groups.items())
@@ -0,0 +1,151 @@
+"""
+Module wraps SGE commands used for submitting jobs and querying their state.
+"""
+
+import os
+import re
+import json
+import time
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .file_utils import CACHE_DIR, write_json_file
+
+# qsub -terse prints only job ID. For array jobs: <job_id>.<first>-<last>:<step>
+_job_id_re = re.compile(r'^(\d+)')
+
+# qsub command. For testing it can be set to a local runner (bin/local_qsub.py)
+QSUB = os.environ.get('ISABELLA_QSUB', 'qsub')
+QALTER = os.environ.get('ISABELLA_QALTER', 'qalter')
+
+# Submission settings. qmaster handles few concurrent requests well, but not hundreds.
+SUBMIT_WORKERS = 8
+SUBMIT_RETRIES = 4
+SUBMIT_BACKOFF = 2  # Seconds, doubled on each retry
+
+
+def parse_job_id(output):
+    # Works for -terse output and for standard 'Your job 1234 ("name") has been submitted'
+    output = output.strip()
+    m = _job_id_re.match(output) or re.search(r'Your job(?:-array)? (\d+)', output)
+    return m.group(1) if m else None
+
+
+def qsub(script, cwd=None, args=None, retries=SUBMIT_RETRIES, backoff=SUBMIT_BACKOFF):
+    # Submits script and returns SGE job ID, or None if job was not submitted.
+    # Failed submissions (qmaster busy, ...) are retried with exponential backoff.
+    # Without qsub (not on a cluster) command to run is printed.
+    cmd = [QSUB] + (args or []) + [script]
+    if not shutil.which(QSUB):
+        print(f"cd {cwd or '.'}; {' '.join(cmd)}")
+        return
+
+    for attempt in range(retries + 1):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        r = subprocess.run(cmd[:1] + ['-terse'] + cmd[1:], cwd=cwd,
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        job_id = parse_job_id(r.stdout) if r.returncode == 0 else None
+        if job_id:
+            return job_id
+    print(f"Error: submitting {script} in {cwd or '.'} failed! {r.stderr.strip()}")
+
+
+def qalter(job_id, args):
+    # Changes attributes of submitted job. Returns True on success.
+    cmd = [QALTER] + args + [job_id]
+    if not shutil.which(QALTER):
+        print(' '.join(cmd))
+        return False
+    r = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if r.returncode != 0:
+        print(f"Error: altering job {job_id} failed! {r.stderr.strip()}")
+    return r.returncode == 0
+
+
+def qsub_all(submissions, max_workers=SUBMIT_WORKERS):
+    # Submits list of (script, cwd, args) concurrently. Returns list of job IDs in the same order.
+    if not submissions:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(submissions))) as executor:
+        return list(executor.map(lambda s: qsub(*s), submissions))
+
+
+# ---------------------------------------------------------
+# Job states
+# ---------------------------------------------------------
+QSTAT_CACHE = os.path.join(CACHE_DIR, 'qstat.json')
+QSTAT_TTL = 60  # Seconds
+
+
+def _state_desc(state):
+    # Maps SGE state code (qw, hqw, r, t, Eqw, dr, ...) into a short description
+    if 'E' in state:
+        return 'error'
+    if 'd' in state:
+        return 'deleting'
+    if 'h' in state:
+        return 'held'
+    if 's' in state or 'S' in state or 'T' in state:
+        return 'suspended'
+    if 'r' in state or 't' in state:
+        return 'running'
+    return 'queued'
+
+
+def _task_ids(tasks):
+    # Tasks are listed as: 3, 1-10:1 or comma separated combination of these
+    for part in tasks.split(','):
+        if '-' in part:
+            rng, _, step = part.partition(':')
+            first, last = rng.split('-')
+            yield from range(int(first), int(last) + 1, int(step or 1))
+        elif part:
+            yield int(part)
+
+
+def qstat():
+    # Returns dict SGE job ID (<job_id> or <job_id>.<task_id>) -> state description for user's jobs,
+    # with one qstat call. Returns None if qstat is not available.
+    if not shutil.which('qstat'):
+        return
+    r = subprocess.run(['qstat', '-xml'], stdout=subprocess.PIPE, universal_newlines=True)
+    if r.returncode != 0:
+        return
+
+    import xml.etree.ElementTree as ET
+    states = dict()
+    for job in ET.fromstring(r.stdout).iter('job_list'):
+        job_id = job.findtext('JB_job_number')
+        state = _state_desc(job.findtext('state') or '')
+        tasks = job.findtext('tasks')
+        if tasks:
+            states.update((f'{job_id}.{t}', state) for t in _task_ids(tasks))
+        else:
+            states[job_id] = state
+    return states
+
+
+def cached_qstat(ttl=QSTAT_TTL, not_before=None):
+    # qstat() result cached in a file for ttl seconds, so repeated status checks don't load qmaster.
+    # Cache older than not_before (timestamp) is not used.
+    now = time.time()
+    try:
+        with open(QSTAT_CACHE, 'r') as _in:
+            cache = json.load(_in)
+        if now - cache['time'] < ttl and cache['time'] >= (not_before or 0):
+            return cache['states']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    states = qstat()
+    if states is not None and ttl > 0:
+        write_json_file(QSTAT_CACHE, dict(time=now, states=states))
+    return states
+
+
+def job_state(states, job_id):
+    # Returns state of job with given ID, array task IDs (<job_id>.<task_id>) are also checked by job ID
+    if states is None or not job_id:
+        return
+    return states.get(job_id) or states.get(job_id.split('.', 1)[0])
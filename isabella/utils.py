@@ -1,13 +1,40 @@
 import os
-import shutil
-import subprocess
-from .environment_desc import get_program_and_queue
-from .processing import Processing
+import math
+import shlex
+from collections import namedtuple, OrderedDict
+from .environment_desc import get_program_and_queue, get_queue, get_program_desc, max_queue_days, \
+    max_queue_memory_gb, mpi_process_count, IsabellaException
+from .processing import Processing, append_processing_status
+from .journal import append_job_status
+from .sge import qsub, qsub_all, qalter
+from .monitor import SAMPLE_INTERVAL
+from .planner import PLAN_THREADS
 
 _ISABELLA_MODULE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 _ISABELLA_BIN_DIR = os.path.join(_ISABELLA_MODULE_DIR, 'bin')
 
 
+SYNC_INTERVAL = 1800  # Seconds between syncs of staged job files
+CHECKPOINT_MARGIN_HOURS = 1  # Soft runtime limit before queue's limit, for checkpoint and resubmit
+MAX_SEGMENTS = 20  # Maximal number of continuations of a resubmitted job
+MEMORY_MARGIN = 1.5  # Safety factor on estimated memory
+SLOT_MEMORY_OVERHEAD_GB = 0.25  # Per slot (thread stacks, malloc arenas, ...)
+HARD_MEMORY_FACTOR = 2  # Hard memory limit (h_vmem) relative to requested memory
+HARD_MEMORY_MIN_GB = 4  # Per slot. Virtual memory is larger than resident, estimate shouldn't kill a job.
+
+# Job created by a create scripts method.
+# Jobs with the same program, queue and number of threads can be submitted as one array job.
+# depends_on: directories of jobs that have to finish before the job starts
+# parallel: parallel environment of MPI jobs (mpi, mpifull)
+# memory_gb: requested memory per slot
+# runtimes: estimated runtimes (hours) per number of slots, set for simulated runs (see planner.py)
+# alone: job script has directives (soft runtime limit, notify) that array and bundle scripts don't pass,
+#        so job is not grouped
+_Job = namedtuple('_Job', 'directory, name, program, queue, num_threads, depends_on, parallel, memory_gb, runtimes, '
+                          'alone')
+_Job.__new__.__defaults__ = (None, None, None, None, None)
+
+
 def write_str_in_file(filename, s):
     with open(filename, 'w') as r:
         r.write(s)
@@ -18,6 +45,21 @@ def standard_arguments(parser):
                         help="Number of threads. Can be specified as ingteger (8), or a range (4-8)")
     parser.add_argument('-S', '--simulate', action='store_true', help="Simulate run, without actual running")
     parser.add_argument('-m', '--email', help="Email address for start/end notices")
+    parser.add_argument('--tune-threads', action='store_true',
+                        help="For range of threads, choose number of threads per job from past runs scaling")
+    parser.add_argument('--stage', action='store_true',
+                        help="Run jobs on node local disk ($TMPDIR), syncing output files back")
+    parser.add_argument('--sync-interval', default=SYNC_INTERVAL, type=int,
+                        help=f"Seconds between syncs of staged output files (default {SYNC_INTERVAL})")
+    parser.add_argument('--sample-interval', default=SAMPLE_INTERVAL, type=int,
+                        help=f"Seconds between resource usage samples of running program (default {SAMPLE_INTERVAL}). "
+                             "0 disables measuring")
+    parser.add_argument('--split', default=1, type=int,
+                        help="Split jobs into given number of independent jobs, and a job that gathers their results. "
+                             "Used for programs that support it (RAxML bootstraps, MrBayes runs)")
+    parser.add_argument('--resubmit', action='store_true',
+                        help="Jobs that reach queue time limit are resubmitted to resume from program's checkpoint. "
+                             "Used for programs that support it (MrBayes)")
 
 
 def parse_num_threads(num_threads):
@@ -30,9 +72,92 @@ def parse_num_threads(num_threads):
     return (int(parts[0]), int(parts[1]))
 
 
+_runtime_db = None
+
+
+def _get_runtime_db():
+    # Runtime database is opened once, if it exists
+    global _runtime_db
+    if _runtime_db is None:
+        from .runtime_db import RuntimeDB, RUNTIME_DB
+        _runtime_db = RuntimeDB() if os.path.isfile(RUNTIME_DB) else False
+    return _runtime_db
+
+
+def estimate_runtime_days(program_type, num_threads, cwd, job_desc):
+    # Runtime hint from job description (runtime_hours), or estimate from runtime database of past runs
+    if job_desc.get('runtime_hours'):
+        return float(job_desc['runtime_hours']) / 24
+
+    db = _get_runtime_db()
+    if db:
+        features = get_program_desc(program_type).job_input_features(cwd, job_desc) or dict()
+        seconds = db.estimate(program_type, num_threads, **features)
+        if seconds:
+            return seconds / (24 * 3600)
+
+
+def plan_runtimes(program_type, cwd, job_desc, slots, threaded):
+    # Estimated runtimes (hours, None if not known) on job's slots and, for threaded jobs, on planner's numbers
+    # of threads. Runtime hint (runtime_hours) is for job's slots, other numbers are estimated from past runs.
+    runtimes = dict()
+    for n in sorted(set((slots,) + (PLAN_THREADS if threaded else ()))):
+        days = estimate_runtime_days(program_type, n, cwd, job_desc) \
+            if n == slots or not job_desc.get('runtime_hours') else None
+        runtimes[n] = days * 24 if days else None
+    return runtimes
+
+
+def tune_num_threads(program_type, low, high, cwd, job_desc):
+    # Chooses number of threads in range [low, high] for a job.
+    # Returns (num_threads, expected speedup, number of threads speedup is relative to).
+    # Scaling curve of past runs on similar inputs is used, otherwise program's rule of thumb.
+    program_desc = get_program_desc(program_type)
+    features = program_desc.job_input_features(cwd, job_desc) or dict()
+    db = _get_runtime_db()
+    curve = db.scaling_curve(program_type, features.get('alignment_length')) if db else dict()
+    in_range = dict((n, t) for n, t in curve.items() if low <= n <= high)
+    if in_range:
+        # The smallest number of threads with runtime within 5% of the best one
+        best = min(in_range.values())
+        num_threads = min(n for n, t in in_range.items() if t <= best * 1.05)
+        base = min(curve)
+        return num_threads, curve[base] / in_range[num_threads], base
+    return program_desc.suggest_num_threads(features, low, high) or high, None, None
+
+
 def simple_run_script(program_type, cwd, job_desc,
                       name=None, project=None, email=None,
-                      num_threads=1, job_additional_params=None, simulate=False):
+                      num_threads=1, job_additional_params=None, simulate=False,
+                      stage=False, sync_interval=SYNC_INTERVAL, tune_threads=False,
+                      sample_interval=SAMPLE_INTERVAL, split=1, resubmit=False):
+    # Returns _Job, or list of _Jobs if job is split (program's split_job()) into parts and a gather job
+    if split > 1:
+        program_desc = get_program_desc(program_type)
+        split_jobs = program_desc.split_job(cwd, job_desc, split)
+        if split_jobs:
+            args = dict(project=project, email=email, num_threads=num_threads, simulate=simulate, stage=stage,
+                        sync_interval=sync_interval, tune_threads=tune_threads, sample_interval=sample_interval,
+                        resubmit=resubmit)
+            parts, (gather_desc, gather_params) = split_jobs
+            jobs = []
+            for i, (part_dir, part_desc, part_params) in enumerate(parts):
+                os.makedirs(part_dir, exist_ok=True)
+                j = simple_run_script(program_type, part_dir, part_desc, name=(f'{name}-{i + 1}' if name else None),
+                                      job_additional_params=dict(job_additional_params or {}, **part_params), **args)
+                if not j:
+                    return
+                jobs.append(j)
+            # Gather job without threaded command line is run on one CPU
+            if not gather_desc.get('threads'):
+                args['num_threads'] = 1
+            j = simple_run_script(program_type, cwd, gather_desc, name=name,
+                                  job_additional_params=dict(job_additional_params or {}, **gather_params), **args)
+            if not j:
+                return
+            return jobs + [j._replace(depends_on=tuple(p.directory for p in jobs))]
+        print(f"Warning: job {cwd} can't be split, it is run as one job.")
+
     # Check available command lines
     single_cmd = job_desc.get('single')
     threads_cmd = job_desc.get('threads')
@@ -43,58 +168,268 @@ def simple_run_script(program_type, cwd, job_desc,
     # Make run script for programs that depend only on num_threads
     nt = parse_num_threads(num_threads)
     max_num_threads = nt if isinstance(nt, int) else nt[1]
-    program, queue = get_program_and_queue(program_type, max_num_threads, single_cmd, threads_cmd)
-    if not program:
+    if tune_threads and not isinstance(nt, int):
+        num_threads, speedup, base = tune_num_threads(program_type, nt[0], nt[1], cwd, job_desc)
+        max_num_threads = num_threads
+        job_additional_params = dict(job_additional_params or {}, tuned_threads=num_threads)
+        if speedup:
+            job_additional_params.update(expected_speedup=f'{speedup:.2f}', speedup_base_threads=base)
+
+    # Resumed job is chained, so it fits any queue
+    resume_desc = None
+    if resubmit:
+        if stage:
+            print(f"Warning: job {cwd} is staged, it can't be resubmitted from checkpoint.")
+        else:
+            resume_desc = get_program_desc(program_type).resume_job(cwd, job_desc)
+            if not resume_desc:
+                print(f"Warning: job {cwd} can't be resumed from checkpoint.")
+
+    def runtime_days(nt):
+        return None if resume_desc else estimate_runtime_days(program_type, nt, cwd, job_desc)
+
+    # Memory from job description, or estimated from inputs with safety margin
+    program_desc = get_program_desc(program_type)
+    estimated_gb = program_desc.estimate_memory_gb(cwd, job_desc)
+    memory_gb = float(job_desc['memory_gb']) if job_desc.get('memory_gb') else \
+        (estimated_gb * MEMORY_MARGIN if estimated_gb else None)
+    if memory_gb and memory_gb > max_queue_memory_gb():
+        print(f"Error: job {cwd} needs {memory_gb:.1f}GB of memory, more than any node has!")
         return
+    # Requested number of threads bounds number of MPI processes
+    mpi_processes = program_desc.mpi_processes(cwd, job_desc)
+    if mpi_processes:
+        mpi_processes = mpi_process_count(mpi_processes, max_num_threads)
+    program, queue = get_program_and_queue(program_type, max_num_threads, single_cmd, threads_cmd,
+                                           runtime_days=runtime_days, memory_gb=memory_gb, mpi_processes=mpi_processes)
+    if not program:
+        # Job doesn't fit any queue. If runtime is estimated from past runs, use the longest queue
+        program, queue = get_program_and_queue(program_type, max_num_threads, single_cmd, threads_cmd,
+                                               runtime_days=lambda nt: max_queue_days(), memory_gb=memory_gb,
+                                               mpi_processes=mpi_processes)
+        if not program:
+            print(f"Error: job {cwd} doesn't fit any queue!")
+            return
+        used_cpus = dict(threads=max_num_threads, mpi=mpi_processes or max_num_threads).get(program.parallel, 1)
+        days = runtime_days(used_cpus)
+        if job_desc.get('runtime_hours'):
+            print(f"Error: job {cwd} needs {days:.1f} days, longer than limit of any queue!")
+            return
+        print(f"Warning: job {cwd} is estimated to run {days:.1f} days, longer than limit of any queue!")
 
-    if program.parallel == 'threads':
+    parallel = None
+    if program.parallel == 'mpi':
+        # MPI version is started by mpirun on number of processes that job can use, up to requested threads
+        parallel = queue.parallel
+        num_threads = max_num_threads = mpi_processes or max_num_threads
+        cmd_key, cmd_threads = ('single' if single_cmd else 'threads'), "$NSLOTS"
+    elif program.parallel == 'threads':
         # Run threaded version
-        cmd = threads_cmd.format(num_threads=("$NSLOTS" if max_num_threads > 1 else 1), exe=program.program)
+        cmd_key, cmd_threads = 'threads', ("$NSLOTS" if max_num_threads > 1 else 1)
     else:
-        cmd = single_cmd.format(exe=program.program)
+        cmd_key, cmd_threads = 'single', 1
+
+    def _command(desc):
+        # Command line that references executable ({exe}) is run as it is, otherwise executable is prepended
+        cmd = desc[cmd_key].format(num_threads=cmd_threads, exe=program.program)
+        return cmd if '{exe}' in desc[cmd_key] else program.program + ' ' + cmd
+
+    cmd = _command(job_desc)
     assert cmd
 
+    # SGE memory requests are per slot
+    slot_memory_gb = None
+    if memory_gb:
+        nt = parse_num_threads(num_threads)
+        slots = (nt if isinstance(nt, int) else nt[0]) if max_num_threads > 1 else 1
+        slot_memory_gb = math.ceil(10 * (memory_gb / slots + SLOT_MEMORY_OVERHEAD_GB)) / 10
+
     #
-    script = make_script(program_type, program.program + ' ' + cmd, queue.queue,
+    script = make_script(program_type, cmd, queue.queue,
                          name=name, project=project, email=email,
-                         num_threads=(num_threads if max_num_threads > 1 else None),
-                         load_modules=program.modules,
+                         num_threads=(num_threads if max_num_threads > 1 else None), parallel=parallel,
+                         memory_gb=slot_memory_gb, load_modules=program.modules,
                          job_additional_params=job_additional_params,
-                         env_path=program.directory)
+                         env_path=program.directory,
+                         stage_files=((get_program_desc(program_type).files_to_zip(job_additional_params or {}) or ())
+                                      if stage else None),
+                         stage_inputs=job_desc.get('inputs'), sync_interval=sync_interval,
+                         sample_interval=sample_interval,
+                         resume_cmd=(_command(resume_desc) if resume_desc else None),
+                         runtime_limit_hours=queue.max_days * 24 - CHECKPOINT_MARGIN_HOURS)
 
     write_str_in_file(os.path.join(cwd, 'job_script'), script)
 
+    runtimes = None
     if simulate:
         print(cwd)
         print(script)
-    else:
-        if shutil.which('qsub'):
-            subprocess.run(['qsub', 'job_script'], cwd=cwd)
+        slots = max_num_threads if program.parallel != 'single' else 1
+        runtimes = plan_runtimes(program_type, cwd, job_desc, slots, threaded=bool(threads_cmd) and not parallel)
+    return _Job(cwd, name, program.program, queue.queue, (num_threads if max_num_threads > 1 else None),
+                parallel=parallel, memory_gb=slot_memory_gb, runtimes=runtimes, alone=bool(stage or resume_desc))
+
+
+def dependency_waves(dependencies, names=None):
+    # dependencies: list of lists, indices of items that item depends on. names are used in error message.
+    # Returns list of waves (lists of indices), each wave depends only on items of previous waves.
+    # Raises IsabellaException on cyclic dependencies.
+    remaining = list(range(len(dependencies)))
+    done = set()
+    waves = []
+    while remaining:
+        wave = [idx for idx in remaining if all(d in done for d in dependencies[idx])]
+        if not wave:
+            raise IsabellaException(
+                f"Cyclic dependencies between: {', '.join(str(names[i] if names else i) for i in remaining)}")
+        waves.append(wave)
+        done.update(wave)
+        remaining = [idx for idx in remaining if idx not in done]
+    return waves
+
+
+def job_dependencies(jobs):
+    # Returns list of lists of indices of jobs that job depends on
+    index = dict((os.path.normpath(j.directory), idx) for idx, j in enumerate(jobs))
+    return [[index[os.path.normpath(d)] for d in (j.depends_on or ())] for j in jobs]
+
+
+def submit_jobs(jobs, array_job=False, bundle=False, project=None, email=None, simulate=False):
+    # Submits jobs created by create scripts methods, from processing directory.
+    # If bundle is set, single CPU jobs are run in bundles (pilot jobs) that occupy up to a full node.
+    # If array_job is set, jobs with same program, queue and number of threads are submitted as one array job.
+    # Jobs that depend on other jobs are submitted in waves, after their dependencies, with -hold_jid.
+    # Dependent jobs with the same holds are grouped into an array job held with -hold_jid. Dependent jobs are not
+    # bundled. MPI jobs, and staged or resubmitted jobs (SGE reads only directives of the submitted script)
+    # are not grouped into array or bundle jobs. Jobs with a dependency that was not submitted
+    # are not submitted, otherwise they would start without its results.
+    # If simulate is set, scripts are printed and makespan of jobs is planned (see planner.py).
+    # Submissions of a wave run concurrently. SGE job IDs are stored in processing status file:
+    #  - job_id_<idx>: <job_id>[.<task_id>]
+    #  - array_job_<n>: <job_id>
+    #  - bundle_job_<n>: <job_id>
+    dependencies = job_dependencies(jobs)
+    num_alone = sum(1 for j in jobs if j.alone)
+    if (array_job or bundle) and num_alone:
+        print(f"Warning: {num_alone} staged or resubmitted jobs are submitted separately, not in array or bundle jobs.")
+    job_ids = dict()  # job index -> SGE job ID
+    counts = dict(array=0, bundle=0)
+    for wave in dependency_waves(dependencies):
+        _submit_wave(jobs, wave, dependencies, job_ids, counts, array_job=array_job, bundle=bundle,
+                     project=project, email=email, simulate=simulate)
+    if simulate:
+        from .planner import print_plan
+        print_plan(jobs, bundle=bundle)
+
+
+def _submit_wave(jobs, wave, dependencies, job_ids, counts, array_job=False, bundle=False, project=None, email=None,
+                 simulate=False):
+    if not simulate:
+        not_submitted = [idx for idx in wave if any(d not in job_ids for d in dependencies[idx])]
+        for idx in not_submitted:
+            missing = ', '.join(jobs[d].directory for d in dependencies[idx] if d not in job_ids)
+            print(f"Error: job {jobs[idx].directory} is not submitted, since its dependencies are not: {missing}")
+        wave = [idx for idx in wave if idx not in not_submitted]
+
+    def _hold(idx):
+        # SGE jobs that job waits for. Array task dependency waits for the whole array job.
+        if simulate:
+            return tuple(sorted(dependencies[idx]))
+        return tuple(sorted(set(job_ids[d].split('.', 1)[0] for d in dependencies[idx])))
+
+    groups = OrderedDict()
+    for idx in wave:
+        job = jobs[idx]
+        if job.parallel or job.alone:
+            key = idx
+        elif dependencies[idx]:
+            # Jobs that wait for the same jobs can be one held array job
+            key = (job.program, job.queue, job.num_threads, job.memory_gb, _hold(idx)) if array_job else idx
+        elif bundle and not job.num_threads:
+            key = ('bundle', job.queue)
         else:
-            print(f'cd {cwd}; qsub job_script')
+            key = (job.program, job.queue, job.num_threads, job.memory_gb) if array_job else idx
+        groups.setdefault(key, []).append(idx)
 
+    submissions = []  # job indices, script filename (None for job_script), kind
+    scripts = []
+    for key, idxs in groups.items():
+        if len(idxs) == 1:
+            submissions.append((idxs, None, None))
+        elif key[0] == 'bundle':
+            # Jobs are evenly split into bundles of at most node's number of cores
+            max_slots = get_queue('threads', 1, ()).cpus
+            num_bundles = (len(idxs) + max_slots - 1) // max_slots
+            for b in range(num_bundles):
+                b_idxs = idxs[b::num_bundles]
+                filename = f'bundle_job_{counts["bundle"]}'
+                counts['bundle'] += 1
+                memory = [jobs[i].memory_gb for i in b_idxs if jobs[i].memory_gb]
+                scripts.append((filename, make_bundle_script(
+                    filename, [jobs[i].directory for i in b_idxs], jobs[b_idxs[0]].queue,
+                    project=project, email=email, memory_gb=(max(memory) if memory else None))))
+                submissions.append((b_idxs, filename, 'bundle'))
+        else:
+            a_idx = counts['array']
+            counts['array'] += 1
+            filename = f'array_job_{a_idx}'
+            job = jobs[idxs[0]]
+            scripts.append((filename, make_array_script(
+                f'{job.program}-{a_idx}', [jobs[i].directory for i in idxs], job.queue,
+                project=project, email=email, num_threads=job.num_threads, memory_gb=job.memory_gb)))
+            submissions.append((idxs, filename, 'array'))
 
-def make_script(program_type, cmd, queue, name=None, project=None, email=None, num_threads=None,
-                load_modules=None, job_additional_params=None, env_path=None):
-    # https://wiki.srce.hr/display/RKI/Pokretanje+i+upravljanje+poslovima#Pokretanjeiupravljanjeposlovima-Resursi
-    script = '#!/bin/bash\n\n'
-    for val, flag in ((name, 'N'), (project, 'P'), (num_threads, 'pe *mpisingle'), (queue, 'q')):
-        if val:
-            script += f'#$ -{flag} {val}\n'
-    script += """#$ -cwd
-#$ -o stdout.out
-#$ -e stderr.out
-"""
+    for filename, script in scripts:
+        write_str_in_file(filename, script)
+        if simulate:
+            print(filename)
+            print(script)
+    if simulate:
+        return
 
-    if email:
-        script += f"""#$ -M {email}
-#$ -m e
-"""
-    script += f"""
-# Set environment
-export PYTHONPATH={_ISABELLA_MODULE_DIR}:$PYTHONPATH
-export PATH={_ISABELLA_BIN_DIR}:$PATH
-"""
+    def _hold_args(idxs):
+        hold = sorted(set(h for i in idxs for h in _hold(i)))
+        return ['-hold_jid', ','.join(hold)] if hold else None
+
+    status = dict()
+    ids = qsub_all([(filename or 'job_script', None if filename else jobs[idxs[0]].directory, _hold_args(idxs))
+                    for idxs, filename, _ in submissions])
+    for job_id, (idxs, filename, kind) in zip(ids, submissions):
+        if not job_id:
+            continue
+        if kind == 'array':
+            status[filename] = job_id
+            task_ids = [(i, f'{job_id}.{task_id}') for task_id, i in enumerate(idxs, start=1)]
+        else:
+            if kind == 'bundle':
+                status[filename] = job_id
+            task_ids = [(i, job_id) for i in idxs]
+        job_ids.update(task_ids)
+        status.update((f'job_id_{i}', t_id) for i, t_id in task_ids)
+
+    if status:
+        append_processing_status(status)
+
+
+def make_script(program_type, cmd, queue, name=None, project=None, email=None, num_threads=None, parallel=None,
+                memory_gb=None, load_modules=None, job_additional_params=None, env_path=None,
+                stage_files=None, stage_inputs=None, sync_interval=SYNC_INTERVAL, sample_interval=None,
+                resume_cmd=None, runtime_limit_hours=None):
+    # https://wiki.srce.hr/display/RKI/Pokretanje+i+upravljanje+poslovima#Pokretanjeiupravljanjeposlovima-Resursi
+    # If stage_files is set, program is run on node local disk (see _stage_run()).
+    # If sample_interval is set, program's resource usage is measured and stored in job's data (see monitor.py).
+    # MPI program (parallel is mpi or mpifull) is run by mpirun with num_threads processes.
+    # If resume_cmd is set, job is resubmitted on soft runtime limit (see _resubmit_run()).
+    # memory_gb is requested memory per slot.
+    directives = []
+    if stage_files is not None:
+        # SGE sends SIGUSR1 before suspending and SIGUSR2 before killing the job
+        directives.append('-notify')
+    if resume_cmd and runtime_limit_hours:
+        # SGE sends SIGUSR1 when soft runtime limit is reached
+        directives.append(f'-l s_rt={int(runtime_limit_hours)}:00:00')
+    script = _script_header(queue, name=name, project=project, num_threads=num_threads, parallel=parallel,
+                            memory_gb=memory_gb, directives=directives, email=email)
 
     if env_path:
         if isinstance(env_path, str):
@@ -111,6 +446,23 @@ export PATH={_ISABELLA_BIN_DIR}:$PATH
     else:
         jap = ''
 
+    def _wrap(c):
+        if parallel:
+            c = f'mpirun -np $NSLOTS {c}'
+        if sample_interval:
+            c = f'job_measure.py -i {sample_interval} "$JOB_DIR" {c}'
+        return c
+
+    if sample_interval:
+        # Job directory is fixed before staging changes working directory
+        script += 'JOB_DIR="$(pwd)"\n'
+    if resume_cmd:
+        cmd = _resubmit_run(_wrap(cmd), _wrap(resume_cmd))
+    else:
+        cmd = _wrap(cmd)
+    if stage_files is not None:
+        cmd = _stage_run(cmd, stage_files, stage_inputs, sync_interval)
+
     script += f"""
 # Run script
 job_pre_run.py {program_type}{jap}
@@ -121,12 +473,244 @@ job_post_run.py
     return script
 
 
+def _script_header(queue, name=None, project=None, num_threads=None, parallel=None, memory_gb=None,
+                   stdout='stdout.out', stderr='stderr.out', directives=(), email=None, environment=True):
+    # SGE directives of a job script, and environment for isabella's scripts if environment is set.
+    # directives: additional qsub options
+    script = '#!/bin/bash\n\n'
+    for val, flag in ((name, 'N'), (project, 'P'), (num_threads, f'pe *{parallel or "mpisingle"}'), (queue, 'q')):
+        if val:
+            script += f'#$ -{flag} {val}\n'
+    script += _memory_request(memory_gb, num_threads)
+    script += f"""#$ -cwd
+#$ -o {stdout}
+#$ -e {stderr}
+"""
+    script += ''.join(f'#$ {d}\n' for d in directives)
+
+    if email:
+        script += f"""#$ -M {email}
+#$ -m e
+"""
+    if environment:
+        script += f"""
+# Set environment
+export PYTHONPATH={_ISABELLA_MODULE_DIR}:$PYTHONPATH
+export PATH={_ISABELLA_BIN_DIR}:$PATH
+"""
+    return script
+
+
+def _background(cmd):
+    # Program ignores SGE warning signals, they are handled by job script. SGE signals the whole process group.
+    return f"( trap '' USR1 USR2; exec {cmd} ) &"
+
+
+def _resubmit_run(cmd, resume_cmd):
+    # Continuation job (ISABELLA_SEGMENT is set) resumes program from checkpoint.
+    # When soft runtime limit is reached, continuation is submitted (job_resubmit.py) and program is stopped.
+    # Jobs that wait for this job are held also on the continuation.
+    # Resubmitted job exits without job_post_run.py, job is finished by the last segment.
+    return f"""
+if [ -n "$ISABELLA_SEGMENT" ]; then
+    {_background(resume_cmd)}
+else
+    {_background(cmd)}
+fi
+PROGRAM_PID=$!
+# If continuation is not submitted, program runs until the hard limit
+trap 'if job_resubmit.py; then RESUBMITTED=1; kill $PROGRAM_PID 2> /dev/null; fi' USR1 XCPU
+# wait is interrupted by trapped signals
+while ! wait $PROGRAM_PID; do kill -0 $PROGRAM_PID 2> /dev/null || break; done
+[ -n "$RESUBMITTED" ] && exit 0
+"""
+
+
+def _stage_run(cmd, stage_files, stage_inputs, sync_interval):
+    # Job inputs (or whole job directory) are copied into $TMPDIR, and program is run there.
+    # Files to zip are periodically synced back. Final copy of all changed files is done when program
+    # finishes, or on SGE warning signals. On kill warning script exits without job_post_run.py.
+    # Note: inputs outside of job directory has to be referenced with absolute paths.
+    if stage_inputs:
+        copy_inputs = f'cp -rp --parents {" ".join(shlex.quote(f) for f in stage_inputs)} "$STAGE_DIR"'
+    else:
+        copy_inputs = 'cp -rp . "$STAGE_DIR"'
+    files = ' '.join(shlex.quote(f) for f in stage_files)
+
+    return f"""
+# Stage job to node local disk
+JOB_DIR=$(pwd)
+STAGE_DIR=$(mktemp -d "${{TMPDIR:-/tmp}}/isabella.XXXXXX")
+{copy_inputs}
+
+stage_sync() {{
+    for f in {files}; do
+        [ -f "$STAGE_DIR/$f" ] && cp -p "$STAGE_DIR/$f" "$JOB_DIR/$f"
+    done
+}}
+stage_final() {{
+    cp -rpu "$STAGE_DIR/." "$JOB_DIR/"
+}}
+trap stage_final USR1
+trap 'stage_final; kill $SYNC_PID; exit 143' USR2 TERM
+
+cd "$STAGE_DIR"
+( trap '' USR1 USR2; while sleep {sync_interval}; do stage_sync; done ) &
+SYNC_PID=$!
+{_background(cmd)}
+PROGRAM_PID=$!
+# wait is interrupted by trapped signals
+while ! wait $PROGRAM_PID; do kill -0 $PROGRAM_PID 2> /dev/null || break; done
+kill $SYNC_PID
+stage_final
+cd "$JOB_DIR"
+rm -rf "$STAGE_DIR"
+"""
+
+
+def _memory_request(memory_gb, num_threads=None):
+    # Scheduling request (mem_free) is the estimate. Hard limit (h_vmem) only stops a runaway job,
+    # so it is generous, but slots of a job still fit on a node.
+    if not memory_gb:
+        return ''
+    nt = parse_num_threads(num_threads) if num_threads else 1
+    slots = nt if isinstance(nt, int) else nt[1]
+    hard_gb = min(max(HARD_MEMORY_FACTOR * memory_gb, HARD_MEMORY_MIN_GB), max_queue_memory_gb() / slots)
+    hard_gb = max(math.floor(10 * hard_gb) / 10, memory_gb)
+    return f'#$ -l h_vmem={hard_gb:g}G,mem_free={memory_gb:g}G\n'
+
+
+def make_array_script(name, job_directories, queue, project=None, email=None, num_threads=None, memory_gb=None):
+    # Array job runs job_script of the job directory mapped by SGE_TASK_ID.
+    # Directories are relative to processing directory in which array job is started.
+    # Job script sets its environment.
+    script = _script_header(queue, name=name, project=project, num_threads=num_threads, memory_gb=memory_gb,
+                            stdout='/dev/null', stderr=f'{name}.stderr.out',
+                            directives=[f'-t 1-{len(job_directories)}'], email=email, environment=False)
+    dirs = '\n'.join(f'    {shlex.quote(d)}' for d in job_directories)
+    script += f"""
+JOB_DIRECTORIES=(
+{dirs}
+)
+
+# Run job script in job's directory
+cd ${{JOB_DIRECTORIES[$((SGE_TASK_ID - 1))]}} || exit 1
+exec bash job_script > stdout.out 2> stderr.out
+"""
+
+    return script
+
+
+def make_collect_script(name, queue, project=None):
+    # Single slot job that collects output of processing it is started in
+    script = _script_header(queue, name=name, project=project,
+                            stdout='collect_job.stdout.out', stderr='collect_job.stderr.out')
+    script += """
+processing_collect.py --email
+"""
+    return script
+
+
+def submit_collect_job(processing):
+    # Output collection and post email are done in a separate single slot job, so that node of
+    # the last finished job is freed. Collect job waits for the current job (if any) to finish.
+    queue = get_queue('single', 1, ())
+    script = make_collect_script(f'{os.path.basename(processing.directory)}-collect', queue.queue)
+    write_str_in_file(os.path.join(processing.directory, 'collect_job'), script)
+    job_id = os.environ.get('JOB_ID')
+    collect_job_id = qsub('collect_job', cwd=processing.directory, args=(['-hold_jid', job_id] if job_id else None))
+    if collect_job_id:
+        append_processing_status(dict(collect_job_id=collect_job_id), directory=processing.directory)
+
+
+def make_bundle_script(name, job_directories, queue, project=None, email=None, memory_gb=None):
+    # Bundle job runs job_script of given job directories with a worker pool of NSLOTS workers.
+    # Directories are relative to processing directory in which bundle job is started.
+    script = _script_header(queue, name=name, project=project, num_threads=len(job_directories),
+                            memory_gb=memory_gb, stdout='/dev/null', stderr=f'{name}.stderr.out', email=email)
+    dirs = ' \\\n    '.join(shlex.quote(d) for d in job_directories)
+    script += f"""
+job_bundle_run.py \\
+    {dirs}
+"""
+
+    return script
+
+
+def run_bundle(job_directories, workers=None):
+    # Runs job scripts concurrently. Each job is run as it would be run by SGE with one slot:
+    # in its directory, with stdout and stderr files, and NSLOTS set to 1.
+    import subprocess
+    from concurrent.futures import ThreadPoolExecutor
+
+    env = dict(os.environ, NSLOTS='1')
+
+    def _run(job_directory):
+        with open(os.path.join(job_directory, 'stdout.out'), 'w') as _out, \
+                open(os.path.join(job_directory, 'stderr.out'), 'w') as _err:
+            subprocess.run(['bash', 'job_script'], cwd=job_directory, env=env, stdout=_out, stderr=_err)
+
+    workers = workers or int(os.environ.get('NSLOTS') or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(_run, job_directories))
+
+
 #
 def on_finish_job():
+    # Journal is read only if this job takes post-processing
+    processing = Processing(read=False)
+    if processing.mark_job_finished():
+        if processing.data.get('collect_job'):
+            submit_collect_job(processing)
+        else:
+            processing.send_post_email()
+            processing.collect_output()
+
+
+def resubmit_job():
+    # Called from job script when soft runtime limit is reached. Submits job script as continuation
+    # (next segment) that waits for this job to end, and records it in job and processing status.
+    # Returns True if continuation is submitted.
+    from .processing import read_job_data
+    job_data = read_job_data() or dict()
+    segment = int(job_data.get('segment') or 1) + 1
+    if segment > MAX_SEGMENTS:
+        print(f"Error: job reached maximal number of segments ({MAX_SEGMENTS})!")
+        return False
+    job_id = os.environ.get('JOB_ID')
+    new_job_id = qsub('job_script', args=(['-hold_jid', job_id] if job_id else []) +
+                      ['-v', f'ISABELLA_SEGMENT={segment}'])
+    if not new_job_id:
+        return False
+    append_job_status({f'resubmitted_{segment}': new_job_id})
     processing = Processing()
-    if processing.is_finished():
-        processing.send_post_email()
-        processing.collect_output()
+    idx = processing.job_index('.') if processing.is_processing() else None
+    if idx is not None:
+        def _resubmitted(journal):
+            # Under the lock, so concurrently resubmitted dependencies don't overwrite each other's holds
+            _hold_dependents(journal, idx, new_job_id)
+            return {f'job_id_{idx}': new_job_id}, None
+
+        processing.journal.update(_resubmitted)
+    return True
+
+
+def _hold_dependents(journal, idx, job_id):
+    # Dependents are held on SGE job of the first segment, so continuation is added to holds of dependents
+    # that didn't start yet. qalter replaces hold list, so it is set to current SGE jobs of all dependencies.
+    data = dict(journal.processing)
+    data[f'job_id_{idx}'] = job_id
+
+    def _sge_job(i):
+        # Array task dependency waits for the whole array job
+        return data[f'job_id_{i}'].split('.', 1)[0] if f'job_id_{i}' in data else None
+
+    depends = dict((k[12:], v.split(',')) for k, v in data.items() if k.startswith('job_depends_') and v)
+    waiting = set(_sge_job(i) for i, deps in depends.items()
+                  if str(idx) in deps and journal.job_data(data[f'job_dir_{i}']) is None) - {None}
+    for sge_job in sorted(waiting):
+        hold = sorted(set(_sge_job(d) for i, deps in depends.items() if _sge_job(i) == sge_job for d in deps) - {None})
+        qalter(sge_job, ['-hold_jid', ','.join(hold)])
 
 
 def send_pre_email():
@@ -0,0 +1,115 @@
+"""
+Live watching of processing status.
+Only records appended to processing journal since the last refresh are parsed, log files are re-read only
+if their size or mtime changed, and from growing log files only appended lines are parsed.
+Cost of a refresh doesn't depend on how long jobs are running.
+"""
+
+import os
+import time
+from datetime import datetime
+from .environment_desc import get_program_desc
+
+
+class IncrementalReader:
+    # Remembers size, mtime and read offset of files
+    def __init__(self):
+        self._files = dict()  # filename -> [size, mtime, offset]
+
+    def changed(self, filename):
+        # Returns True if file changed (or appeared) since the last check
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return self._files.pop(filename, None) is not None
+        info = self._files.get(filename)
+        if info and info[0] == st.st_size and info[1] == st.st_mtime:
+            return False
+        self._files[filename] = [st.st_size, st.st_mtime, info[2] if info else 0]
+        return True
+
+    def new_lines(self, filename):
+        # Returns pair (reset, lines). Only complete lines appended since the last call are returned.
+        # If file shrank (rewritten), it is read from the beginning and reset is True.
+        info = self._files.get(filename)
+        offset = info[2] if info else 0
+        if not self.changed(filename):
+            return False, []
+        info = self._files.get(filename)
+        if not info:
+            return offset > 0, []
+        reset = info[0] < offset
+        if reset:
+            offset = 0
+        with open(filename, 'rb') as _in:
+            _in.seek(offset)
+            data = _in.read(info[0] - offset)
+        end = data.rfind(b'\n') + 1
+        info[2] = offset + end
+        return reset, data[:end].decode(errors='replace').splitlines()
+
+
+class _JobWatch:
+    def __init__(self, directory):
+        self.directory = directory
+        self.job_data = None
+        self.program_desc = None
+        self.progress_file = None
+        self.state = dict()
+
+
+class ProcessingWatcher:
+    def __init__(self, processing):
+        self.processing = processing
+        self.reader = IncrementalReader()
+        self.jobs = dict()  # job directory -> _JobWatch
+
+    def refresh(self):
+        # Updates job data and progress from journal and changed files
+        p = self.processing
+        changed = p.reload()
+
+        for j_dir in p.job_directories():
+            job = self.jobs.get(j_dir)
+            if not job:
+                job = self.jobs[j_dir] = _JobWatch(os.path.join(p.directory, j_dir))
+                changed.add(p.journal.job_key(j_dir))
+
+            if p.journal.job_key(j_dir) in changed:
+                job.job_data = p.job_data(j_dir)
+                program_desc = get_program_desc(job.job_data['program_type']) if job.job_data else None
+                if program_desc is not job.program_desc:
+                    job.program_desc = program_desc
+                    job.state = dict()
+                    pf = program_desc.progress_file(job.job_data) if program_desc else None
+                    job.progress_file = os.path.join(job.directory, pf) if pf else None
+
+            if job.progress_file and not (job.job_data and job.job_data.get('ended')):
+                reset, lines = self.reader.new_lines(job.progress_file)
+                if reset:
+                    job.state = dict()
+                if lines:
+                    job.program_desc.parse_progress(job.state, lines)
+
+    def _progress(self, j_dir, job_data):
+        job = self.jobs.get(j_dir)
+        return job.program_desc.progress(job.state) if job and job.program_desc else ('', None)
+
+    def print_status(self, sge_states=None):
+        # Progress of running jobs is taken from parsed log lines
+        self.processing.print_status(sge_states=sge_states, progress=self._progress)
+
+
+def watch(processing, interval=60, sge_states_method=None):
+    # Refreshes status every interval seconds, until interrupted
+    watcher = ProcessingWatcher(processing)
+    try:
+        while True:
+            watcher.refresh()
+            sge_states = sge_states_method() if sge_states_method else None
+            print('\033[H\033[J', end='')  # Clear screen
+            print(f"{processing.directory} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            watcher.print_status(sge_states=sge_states)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass